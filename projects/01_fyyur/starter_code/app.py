@@ -3,20 +3,38 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
-from datetime import datetime
-import re
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import click
+from datetime import datetime, timedelta
+from functools import wraps
+from itertools import groupby
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, get_flashed_messages, stream_with_context, abort, jsonify, has_request_context
+from flask.json import JSONEncoder
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-import logging
-from logging import Formatter, FileHandler
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from flask_wtf import FlaskForm
 from forms import *
 
 from models import *
+from search import search_with_upcoming_shows
+from matches import find_matches
+from formatters import format_datetime
+from cache import ResponseCache
+from counters import roll_over_shows, recount_shows, uncount_shows, count_shows, shows_changed, \
+  rolled_until_column
+from importer import FORMATS, LOADERS, import_file
+from dbpool import pool_status
+from bookings import find_conflicts, is_booking_conflict, occurrences, RecurrenceError
+from querystats import QueryStats
+from logs import setup_logging
+from etags import etagged
+from assets import Assets, build_assets
+from calendars import iter_calendar, last_modified, is_modified
+from live import LiveFeed
+from jobs import Jobs
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -26,6 +44,21 @@ app = Flask(__name__)
 # import setup and db from models
 setup_db(app)
 
+# cache for the read pages, invalidated by every handler that writes
+response_cache = ResponseCache(app)
+
+# per-route query counts and database time, with N+1 warnings
+query_stats = QueryStats(app)
+
+# fingerprinted, precompressed static files, once `flask build-assets` ran
+assets = Assets(app)
+
+# new shows pushed to /shows/live, across workers when LIVE_BUS is 'socket'
+live_feed = LiveFeed(app)
+
+# side effects of writes, run on background threads after the response
+jobs = Jobs(app)
+
 # TODO: connect to a local postgresql database
 
 #----------------------------------------------------------------------------#
@@ -37,16 +70,50 @@ setup_db(app)
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
-
 app.jinja_env.filters['datetime'] = format_datetime
 
+class ISODateJSONEncoder(JSONEncoder):
+  '''Encodes datetimes in ISO 8601 instead of the HTTP date format.'''
+
+  def default(self, o):
+    if isinstance(o, datetime):
+      return o.isoformat()
+    return super().default(o)
+
+app.json_encoder = ISODateJSONEncoder
+
+#----------------------------------------------------------------------------#
+# Rendering.
+#----------------------------------------------------------------------------#
+
+def render_listing(template_name, **context):
+  '''
+  Render a listing page. When STREAM_LISTINGS is enabled the template is
+  rendered lazily and sent to the client in chunks as it goes, so rows
+  passed in as generators are pulled from the database while the browser
+  is already receiving the page, and never held in memory all at once.
+  '''
+  if not app.config['STREAM_LISTINGS']:
+    return render_template(template_name, **context)
+  # pop flashed messages now, while the session cookie can still be updated
+  get_flashed_messages()
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering()
+  return Response(stream_with_context(stream))
+
+#----------------------------------------------------------------------------#
+# Background jobs.
+#----------------------------------------------------------------------------#
+
+def run_later(task, *args):
+  '''Enqueue task for after the response, once the write it follows has committed.'''
+  try:
+    jobs.enqueue(task, *args)
+  except Exception:
+    # the write is saved all the same
+    app.logger.exception('Could not enqueue %s', task.__name__)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -59,15 +126,48 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+def iter_venue_areas(genre=None):
+  '''
+  Yield the venue directory grouped by city and state, optionally limited
+  to the venues playing genre.
+
+  A single query returns every venue together with its maintained number
+  of upcoming shows, ordered by state, city and id, so the areas can be
+  assembled in one pass instead of querying each city separately. Rows
+  are read from a server-side cursor in batches of STREAM_BATCH_SIZE.
+  '''
+  query = db.session.query(
+      Venue.id, Venue.name, Venue.city, Venue.state,
+      Venue.upcoming_shows_count.label('num_upcoming_shows'))
+  if genre:
+    # served by the GIN index on genres
+    query = query.filter(Venue.genres.contains(db.cast([genre], Venue.genres.type)))
+  rows = query.order_by(Venue.state, Venue.city, Venue.id
+    ).yield_per(app.config['STREAM_BATCH_SIZE'])
+
+  for (city, state), area_venues in groupby(rows, key=lambda row: (row.city, row.state)):
+    yield {
+      "city": city,
+      "state": state,
+      "venues": [{
+        "id": venue.id,
+        "name": venue.name,
+        "num_upcoming_shows": venue.num_upcoming_shows
+      } for venue in area_venues]
+    }
+
+def venue_areas(genre=None):
+  '''Build the whole venue directory as a list, see iter_venue_areas.'''
+  return list(iter_venue_areas(genre))
+
 @app.route('/venues')
+@response_cache.cached
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
   '''
   Display list of venues grouped by city location. The list is
-  organized alphbatically by state and with the smallest id first.
+  organized alphbatically by state and city and with the smallest id first.
 
-  Expected client input: none
+  Expected client input: optional genre, e.g. /venues?genre=Jazz
   Return: render 'venue.html' with venues data in json format
     {
       "city": name of city,
@@ -75,26 +175,22 @@ def venues():
       "venues": {
         "id": venue id,
         "name": venue name,
+        "num_upcoming_shows": num of upcoming show for venue,
       }
     }
 
   '''
-  data=[]
-  cities = Venue.query.distinct(Venue.city, Venue.state).order_by('state').all()
-  for city in cities:
-    venues_list=[]
-    venues = Venue.query.filter_by(city=city.city, state=city.state).order_by('id').all()
-    for venue in venues:
-      venues_list.append({
-        "id": venue.id,
-        "name": venue.name
-      })
-    data.append({
-      "city": city.city,
-      "state": city.state,
-      "venues": venues_list
-    })
-  return render_template('pages/venues.html', areas=data)
+  return render_listing('pages/venues.html', areas=iter_venue_areas(request.args.get('genre')))
+
+def search_window():
+  '''
+  Read the optional limit and offset of a search from the request. The
+  limit defaults to SEARCH_RESULTS_LIMIT and can never exceed it.
+  '''
+  max_limit = app.config['SEARCH_RESULTS_LIMIT']
+  limit = request.values.get('limit', max_limit, type=int)
+  offset = request.values.get('offset', 0, type=int)
+  return min(max(limit, 0), max_limit), max(offset, 0)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -103,10 +199,9 @@ def search_venues():
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
   '''
   Perform Search. Display list of venues that partially match client input
-  search string. The return list is currently unordered. Potentially be 
-  ordered by number of upcomming shows.
+  search string or closely resemble it, ordered by relevance.
 
-  Expected client input: search_term
+  Expected client input: search_term, optional limit and offset
   Return: render 'search_venues.html' with venues data in json format
     {
       "count": num of venues matched for search,
@@ -118,23 +213,53 @@ def search_venues():
     }
 
   '''
-  search_string = '%' + request.form.get('search_term') + '%'
-  venues = Venue.query.filter(Venue.name.ilike(search_string))
-  venue_list=[]
-  for venue in venues:
-    num_upcoming_show = Show.query.filter(Show.venue_id==venue.id).filter(Show.start_time>=datetime.now()).count()
-    venue_list.append({
-      "id": venue.id,
-      "name": venue.name,
-      "num_upcoming_shows": num_upcoming_show
-    })
-  response={
-    "count": len(venue_list),
-    "data": venue_list
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term'))
+  search_term = request.form.get('search_term', '')
+  response = search_with_upcoming_shows(Venue, search_term, *search_window())
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+def split_shows(shows, format_show, rolled_until):
+  '''
+  Split already loaded shows into past and upcoming lists, ordered by
+  start time, at the show counter watermark rolled_until, so they agree
+  with the counters and the API ETag. Each show is turned into a dict by
+  format_show.
+  '''
+  split_at = rolled_until or datetime.now()
+  past_shows, upcoming_shows = [], []
+  for show in sorted(shows, key=lambda show: show.start_time):
+    if show.start_time >= split_at:
+      upcoming_shows.append(format_show(show))
+    else:
+      past_shows.append(format_show(show))
+  return past_shows, upcoming_shows
+
+VENUE_FIELDS = ('id', 'name', 'genres', 'address', 'city', 'state', 'phone', 'website',
+  'facebook_link', 'seeking_talent', 'seeking_description', 'image_link')
+
+def venue_details(venue_id):
+  '''
+  Load venue <venue_id> with its shows and their artists in one query and
+  return its details as a dict, see show_venue. 404 if there is no such venue.
+  '''
+  venue, rolled_until = Venue.query.options(
+      db.joinedload(Venue.shows).joinedload(Show.artist)
+    ).filter_by(id=venue_id).add_columns(rolled_until_column()).first_or_404()
+  past_shows_list, upcoming_shows_list = split_shows(venue.shows, lambda show: {
+    "artist_id": show.artist.id,
+    "artist_name": show.artist.name,
+    "artist_image_link": show.artist.image_link,
+    "start_time": show.start_time
+  }, rolled_until)
+  details = {field: getattr(venue, field) for field in VENUE_FIELDS}
+  details.update(
+    past_shows=past_shows_list,
+    past_shows_count=len(past_shows_list),
+    upcoming_shows=upcoming_shows_list,
+    upcoming_shows_count=len(upcoming_shows_list))
+  return details
 
 @app.route('/venues/<int:venue_id>')
+@response_cache.cached
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -166,37 +291,7 @@ def show_venue(venue_id):
     "upcoming_shows_count": 0,
    }
   '''
-  venue = Venue.query.filter_by(id=venue_id).first()
-  # the query return venue.genres as a list of characters e.g.: ['{','J','A','Z','Z','}']
-  genre_list= re.split(r'[\"\{\}\,]',''.join(venue.genres))
-  # to remove empty item in genre_list
-  venue.genres=[i for i in genre_list if i]
-  
-  venue_past_shows = db.session.query(Show).join(Venue).filter(Venue.id==venue_id).filter(Show.start_time<=datetime.now()).all()
-  venue_upcoming_shows = db.session.query(Show).join(Venue).filter(Venue.id==venue_id).filter(Show.start_time>=datetime.now()).all()
-  past_shows_list = []
-  upcoming_shows_list = []
-
-  for show in venue_past_shows:
-    past_shows_list.append({
-      "artist_id": show.artist.id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": str(show.start_time)
-    })
-  for show in venue_upcoming_shows:
-    upcoming_shows_list.append({
-      "artist_id": show.artist.id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": str(show.start_time)
-    })
-  venue.past_shows = past_shows_list
-  venue.past_shows_count = len(past_shows_list)
-  venue.upcoming_shows = upcoming_shows_list
-  venue.upcoming_shows_count = len(upcoming_shows_list)
-  
-  return render_template('pages/show_venue.html', venue=venue)
+  return render_template('pages/show_venue.html', venue=venue_details(venue_id))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -241,6 +336,7 @@ def create_venue_submission():
       new_venue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres, image_link=image_link, website=website, facebook_link=facebook_link, seeking_talent=seeking_talent, seeking_description=seeking_description)
       db.session.add(new_venue)
       db.session.commit()
+      response_cache.invalidate()
       # on successful db insert, flash success
       flash('Venue ' + request.form['name'] + ' was successfully listed!')
     except:
@@ -254,25 +350,64 @@ def create_venue_submission():
   else:
     return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+def delete_with_shows(model, show_fk, id):
+  '''
+  Delete the venue or artist <id> and all of its shows in one transaction,
+  with set-based statements rather than loading the shows into the session.
+  Returns False if there is no such record.
+  '''
+  connection = db.session.connection()
+  # locking the row first keeps new shows from being booked on it meanwhile
+  found = connection.execute(db.select([model.id]).where(model.id==id).with_for_update()).scalar()
+  if found is None:
+    db.session.rollback()
+    return False
+  shows = show_fk==id
+  uncount_shows(connection, shows)
+  connection.execute(Show.__table__.delete().where(shows))
+  connection.execute(model.__table__.delete().where(model.id==id))
+  db.session.commit()
+  response_cache.invalidate()
+  return True
+
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-  # TODO: Complete this endpoint for taking a venue_id, and using
-  # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  '''
+  Delete venue <venue_id> together with all of its shows
 
-  # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
-  # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+  Return: {'success': True}, or 404 if there is no such venue
+  '''
+  if not delete_with_shows(Venue, Show.venue_id, venue_id):
+    abort(404)
+  return jsonify({'success': True})
 
 
 #  Artists
 #  ----------------------------------------------------------------
+def iter_artists(genre=None):
+  '''
+  Yield the id and name of every artist ordered by name, optionally
+  limited to the artists playing genre. Rows are read from a server-side
+  cursor in batches of STREAM_BATCH_SIZE.
+  '''
+  query = db.session.query(Artist.id, Artist.name)
+  if genre:
+    # served by the GIN index on genres
+    query = query.filter(Artist.genres.contains(db.cast([genre], Artist.genres.type)))
+  for artist in query.order_by(Artist.name).yield_per(app.config['STREAM_BATCH_SIZE']):
+    yield {
+      "id": artist.id,
+      "name": artist.name
+    }
+
 @app.route('/artists')
+@response_cache.cached
 def artists():
   # TODO: replace with real data returned from querying the database
   '''
   Display list of artist from database ordered alphabatically by name
 
-  Expected user input: none
+  Expected user input: optional genre, e.g. /artists?genre=Jazz
   Return: render artists.html with artists data in list of dict
   [{
     "id":
@@ -280,14 +415,7 @@ def artists():
   }]
   '''
 
-  data=[]
-  artists = Artist.query.order_by('name').all()
-  for artist in artists:
-    data.append({
-      "id": artist.id,
-      "name": artist.name
-    })
-  return render_template('pages/artists.html', artists=data)
+  return render_listing('pages/artists.html', artists=iter_artists(request.args.get('genre')))
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -296,10 +424,9 @@ def search_artists():
   # search for "band" should return "The Wild Sax Band".
   '''
   Perform Search. Display list of artists that partially match client input
-  search string. The return list is currently unordered. Potentially be 
-  ordered by number of upcomming shows.
+  search string or closely resemble it, ordered by relevance.
 
-  Expected client input: search_term
+  Expected client input: search_term, optional limit and offset
   Return: render 'search_artists.html' with artists data in json format
     {
       "count": num of matched result,
@@ -311,23 +438,37 @@ def search_artists():
     }
   '''
 
-  search_string = '%' + request.form.get('search_term') + '%'
-  artists = Artist.query.filter(Artist.name.ilike(search_string))
-  artist_list=[]
-  for artist in artists:
-    num_upcoming_show = Show.query.filter(Show.artist_id==artist.id).filter(Show.start_time>=datetime.now()).count()
-    artist_list.append({
-      "id": artist.id,
-      "name": artist.name,
-      "num_upcoming_shows": num_upcoming_show
-    })
-  response={
-    "count": len(artist_list),
-    "data": artist_list
-   }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  search_term = request.form.get('search_term', '')
+  response = search_with_upcoming_shows(Artist, search_term, *search_window())
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+ARTIST_FIELDS = ('id', 'name', 'genres', 'city', 'state', 'phone', 'website',
+  'facebook_link', 'seeking_venue', 'seeking_description', 'image_link')
+
+def artist_details(artist_id):
+  '''
+  Load artist <artist_id> with its shows and their venues in one query and
+  return its details as a dict, see show_artist. 404 if there is no such artist.
+  '''
+  artist, rolled_until = Artist.query.options(
+      db.joinedload(Artist.shows).joinedload(Show.venue)
+    ).filter_by(id=artist_id).add_columns(rolled_until_column()).first_or_404()
+  past_shows_list, upcoming_shows_list = split_shows(artist.shows, lambda show: {
+    "venue_id": show.venue.id,
+    "venue_name": show.venue.name,
+    "venue_image_link": show.venue.image_link,
+    "start_time": show.start_time
+  }, rolled_until)
+  details = {field: getattr(artist, field) for field in ARTIST_FIELDS}
+  details.update(
+    past_shows=past_shows_list,
+    past_shows_count=len(past_shows_list),
+    upcoming_shows=upcoming_shows_list,
+    upcoming_shows_count=len(upcoming_shows_list))
+  return details
 
 @app.route('/artists/<int:artist_id>')
+@response_cache.cached
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -359,37 +500,7 @@ def show_artist(artist_id):
    }
   '''
 
-  artist = Artist.query.filter_by(id=artist_id).first()
-  # the query return artist.genres as a list of characters e.g.: ['{','J','A','Z','Z','}']
-  genre_list= re.split(r'[\"\{\}\,]',''.join(artist.genres))
-  # to remove empty item in genre_list
-  artist.genres=[i for i in genre_list if i]
-  
-  artist_past_shows = db.session.query(Show).join(Artist).filter(Artist.id==artist_id).filter(Show.start_time<=datetime.now()).all()
-  artist_upcoming_shows = db.session.query(Show).join(Artist).filter(Artist.id==artist_id).filter(Show.start_time>=datetime.now()).all()
-  past_shows_list=[]
-  upcoming_shows_list=[]
-  
-  for show in artist_past_shows:
-    past_shows_list.append({
-      "venue_id": show.venue.id,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link,
-      "start_time": str(show.start_time)
-    })
-  for show in artist_upcoming_shows:
-    upcoming_shows_list.append({
-      "venue_id": show.venue.id,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link,
-      "start_time": str(show.start_time)
-    })
-  artist.past_shows = past_shows_list
-  artist.past_shows_count = len(past_shows_list)
-  artist.upcoming_shows = upcoming_shows_list
-  artist.upcoming_shows_count = len(upcoming_shows_list)
-
-  return render_template('pages/show_artist.html', artist=artist)
+  return render_template('pages/show_artist.html', artist=artist_details(artist_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
@@ -434,6 +545,7 @@ def create_artist_submission():
       new_artist = Artist(name=name, city=city, state=state, phone=phone, genres=genres, image_link=image_link, website=website, facebook_link=facebook_link, seeking_venue=seeking_venue, seeking_description=seeking_description)
       db.session.add(new_artist)
       db.session.commit()
+      response_cache.invalidate()
       # on successful db insert, flash success
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
     except:
@@ -448,85 +560,285 @@ def create_artist_submission():
     print(form.errors)
     return render_template('forms/new_artist.html', form=form)
 
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+  '''
+  Delete artist <artist_id> together with all of its shows
+
+  Return: {'success': True}, or 404 if there is no such artist
+  '''
+  if not delete_with_shows(Artist, Show.artist_id, artist_id):
+    abort(404)
+  return jsonify({'success': True})
+
 #  Update
 #  ----------------------------------------------------------------
+def form_values(form):
+  '''The column values of a venue or artist form, without its hidden fields.'''
+  return {name: value for name, value in form.data.items() if name not in ('csrf_token', 'version')}
+
+def apply_changes(record, values):
+  '''
+  Set the values that differ from record on it and return their names.
+  The ORM then updates only those columns, in a single UPDATE that also
+  checks and bumps the record's version.
+  '''
+  changed = [name for name, value in values.items() if getattr(record, name) != value]
+  for name in changed:
+    setattr(record, name, values[name])
+  return changed
+
+# the columns of venues and artists that calendar events show, see iter_show_events
+CALENDAR_COLUMNS = {
+  Venue: {'name', 'address', 'city', 'state'},
+  Artist: {'name'}
+}
+
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  form = ArtistForm()
-  artist={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80"
-  }
-  # TODO: populate form with fields from artist with ID <artist_id>
+  '''
+  Render the form for editing artist <artist_id>, filled with its values
+
+  Return: render 'edit_artist.html', or 404 if there is no such artist
+  '''
+  artist = Artist.query.get_or_404(artist_id)
+  form = EditArtistForm(obj=artist)
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-  # TODO: take values from the form submitted, and update existing
-  # artist record with ID <artist_id> using the new attributes
-
+  '''
+  Update artist <artist_id> with the fields that were changed
+
+  Expected input: the same fields as for a new artist, and the version of
+  the artist the edit started from
+  If someone else changed the artist in the meantime, nothing is written
+  and the form is shown again with the current values and a message.
+  If successful, redirect to the artist page with message 'Artist [name]
+  was successfully updated!'
+  '''
+  artist = Artist.query.get_or_404(artist_id)
+  form = EditArtistForm(request.form)
+  if not form.validate():
+    return render_template('forms/edit_artist.html', form=form, artist=artist)
+
+  conflict_message = ('Artist ' + artist.name + ' was changed by someone else while you were'
+    ' editing it. Review the current values and save again.')
+  if form.version.data != str(artist.version):
+    flash(conflict_message)
+    form = EditArtistForm(formdata=None, obj=artist)
+    return render_template('forms/edit_artist.html', form=form, artist=artist)
+
+  values = form_values(form)
+  values['city'] = values['city'].title()
+  name = values['name']
+  changed = apply_changes(artist, values)
+  if changed:
+    if CALENDAR_COLUMNS[Artist].intersection(changed):
+      # its calendar feed and those of the venues it has shows with list it
+      shows_changed(artist)
+    try:
+      db.session.commit()
+    except StaleDataError:
+      # changed between loading it and writing
+      db.session.rollback()
+      flash(conflict_message)
+      return redirect(url_for('edit_artist', artist_id=artist_id))
+    response_cache.invalidate()
+  flash('Artist ' + name + ' was successfully updated!')
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  form = VenueForm()
-  venue={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60"
-  }
-  # TODO: populate form with values from venue with ID <venue_id>
+  '''
+  Render the form for editing venue <venue_id>, filled with its values
+
+  Return: render 'edit_venue.html', or 404 if there is no such venue
+  '''
+  venue = Venue.query.get_or_404(venue_id)
+  form = EditVenueForm(obj=venue)
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-  # TODO: take values from the form submitted, and update existing
-  # venue record with ID <venue_id> using the new attributes
+  '''
+  Update venue <venue_id> with the fields that were changed
+
+  Expected input: the same fields as for a new venue, and the version of
+  the venue the edit started from
+  If someone else changed the venue in the meantime, nothing is written
+  and the form is shown again with the current values and a message.
+  If successful, redirect to the venue page with message 'Venue [name]
+  was successfully updated!'
+  '''
+  venue = Venue.query.get_or_404(venue_id)
+  form = EditVenueForm(request.form)
+  if not form.validate():
+    return render_template('forms/edit_venue.html', form=form, venue=venue)
+
+  conflict_message = ('Venue ' + venue.name + ' was changed by someone else while you were'
+    ' editing it. Review the current values and save again.')
+  if form.version.data != str(venue.version):
+    flash(conflict_message)
+    form = EditVenueForm(formdata=None, obj=venue)
+    return render_template('forms/edit_venue.html', form=form, venue=venue)
+
+  values = form_values(form)
+  values['city'] = values['city'].title()
+  values['address'] = values['address'].title()
+  name = values['name']
+  changed = apply_changes(venue, values)
+  if changed:
+    if CALENDAR_COLUMNS[Venue].intersection(changed):
+      # its calendar feed and those of the artists it has shows with list it
+      shows_changed(venue)
+    try:
+      db.session.commit()
+    except StaleDataError:
+      # changed between loading it and writing
+      db.session.rollback()
+      flash(conflict_message)
+      return redirect(url_for('edit_venue', venue_id=venue_id))
+    response_cache.invalidate()
+  flash('Venue ' + name + ' was successfully updated!')
   return redirect(url_for('show_venue', venue_id=venue_id))
 
 
 #  Shows
 #  ----------------------------------------------------------------
 
+def encode_cursor(show):
+  '''Encode the keyset position of show as an opaque page cursor.'''
+  return '{}_{}'.format(show.start_time.isoformat(), show.id)
+
+def decode_cursor(cursor):
+  '''Decode a page cursor into a (start_time, id) pair, or None if invalid.'''
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+  except (AttributeError, ValueError):
+    return None
+
+def paginate_shows(after=None, before=None, per_page=None):
+  '''
+  Return one page of shows ordered by (start_time, id), together with the
+  cursors of the previous and next pages (None when there is no such page).
+
+  Pages are found with keyset pagination: the query seeks directly to the
+  cursor position on the (start_time, id) index instead of skipping rows
+  with OFFSET, so every page costs the same. Venues and artists are eager
+  loaded with the shows.
+  '''
+  per_page = per_page or app.config['SHOWS_PER_PAGE']
+  key = db.tuple_(Show.start_time, Show.id)
+  query = Show.query.options(db.joinedload(Show.venue), db.joinedload(Show.artist))
+  after, before = decode_cursor(after), decode_cursor(before)
+
+  if before:
+    shows = query.filter(key < db.tuple_(*before)
+      ).order_by(Show.start_time.desc(), Show.id.desc()).limit(per_page + 1).all()
+    has_prev, has_next = len(shows) > per_page, True
+    shows = shows[:per_page][::-1]
+  else:
+    if after:
+      query = query.filter(key > db.tuple_(*after))
+    shows = query.order_by(Show.start_time, Show.id).limit(per_page + 1).all()
+    has_prev, has_next = after is not None, len(shows) > per_page
+    shows = shows[:per_page]
+
+  prev_cursor = encode_cursor(shows[0]) if shows and has_prev else None
+  next_cursor = encode_cursor(shows[-1]) if shows and has_next else None
+  return shows, prev_cursor, next_cursor
+
+def show_details(show):
+  '''The details of a show whose venue and artist are already loaded, as a dict.'''
+  return {
+    "id": show.id,
+    "venue_id": show.venue.id,
+    "venue_name": show.venue.name,
+    "artist_id": show.artist.id,
+    "artist_name": show.artist.name,
+    "artist_image_link": show.artist.image_link,
+    "start_time": show.start_time,
+    "duration": show.duration
+  }
+
 @app.route('/shows')
+@response_cache.cached
 def shows():
-  '''Display list of shows at /shows ordered by showtime'''
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  
-  data=[]
-  shows = Show.query.order_by('start_time').all()
+  '''
+  Display list of shows at /shows ordered by showtime, one page at a time
+
+  Expected client input: optional page cursor, either after or before
+  Return: render 'shows.html' with one page of shows and the cursors of
+  the previous and next pages
+  '''
+  shows, prev_cursor, next_cursor = paginate_shows(
+    after=request.args.get('after'),
+    before=request.args.get('before'))
+  data = (show_details(show) for show in shows)
+  return render_listing('pages/shows.html', shows=data, prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+def iter_listed_shows(after_id):
+  '''
+  Yield the shows listed after show <after_id> as live feed events, for a
+  client that reconnects, reading them from a server-side cursor
+  '''
+  try:
+    shows = Show.query.options(db.joinedload(Show.venue), db.joinedload(Show.artist)
+      ).filter(Show.id > after_id).order_by(Show.id).yield_per(app.config['STREAM_BATCH_SIZE'])
+    for show in shows:
+      yield show.id, 'show', show_details(show)
+  finally:
+    # the stream stays open long after, without holding a connection
+    db.session.close()
+
+@app.route('/shows/live')
+def live_shows():
+  '''
+  Push the shows listed from now on as Server-Sent Events, one 'show'
+  event each with the show as JSON, instead of clients polling /shows
+
+  Expected client input: optionally a Last-Event-ID header, sent by
+  EventSource when it reconnects, to first receive the shows listed since
+  that show; an id that is not a positive number is ignored
+  Return: a text/event-stream that stays open
+  '''
+  last_id = request.headers.get('Last-Event-ID', 0, type=int)
+  replay = iter_listed_shows(last_id) if last_id > 0 else ()
+  return Response(stream_with_context(live_feed.stream(replay)), mimetype='text/event-stream',
+                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@jobs.task
+def publish_listed_shows(venue_id, start_times):
+  '''
+  Publish the shows just listed at venue <venue_id> to the live feed;
+  start_times are their start times in ISO 8601
+  '''
+  if not has_request_context() and not live_feed.bus.shared:
+    # another process's broker has none of this worker's clients
+    raise RuntimeError('Publishing shows from a background job needs LIVE_BUS=socket')
+  shows = Show.query.options(db.joinedload(Show.venue), db.joinedload(Show.artist)).filter(
+    Show.venue_id==venue_id, Show.start_time.in_([datetime.fromisoformat(start) for start in start_times])
+    ).order_by(Show.id)
   for show in shows:
-    #venue = Venue.query.filter_by(id=show.venue_id).first()
-    #artist = Artist.query.filter_by(id=show.artist_id).first()
-    data.append({
-      "venue_id": show.venue.id,
-      "venue_name": show.venue.name,
-      "artist_id": show.artist.id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": str(show.start_time)
-    })
-  return render_template('pages/shows.html', shows=data)
+    live_feed.publish(show.id, 'show', show_details(show))
+
+def announce_listed_shows(venue_id, start_times):
+  '''
+  Publish the shows just listed at venue <venue_id> to the live feed, from
+  a background job when the bus reaches every worker, and otherwise right
+  away in this worker, whose clients are the only ones it can reach
+  '''
+  start_times = [start.isoformat() for start in start_times]
+  if live_feed.bus.shared:
+    run_later(publish_listed_shows, venue_id, start_times)
+    return
+  try:
+    publish_listed_shows(venue_id, start_times)
+  except Exception:
+    # the shows are listed all the same
+    app.logger.exception('Could not publish the shows listed at venue %s', venue_id)
 
 #  Create Show
 #  ----------------------------------------------------------------
@@ -541,37 +853,422 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   '''
-  Add a new show to the database
+  Add a new show, or every show of a recurring one, to the database
   
   Expected input: artist_id and venue_id that match the primary key in table
-  Artist and Venue repectively. Expect start_time to be in datetime format.
+  Artist and Venue repectively. Expect start_time to be in datetime format,
+  and an optional duration in minutes. A recurring show also has repeat
+  (weekly or biweekly) and either repeat_until, a date, or repeat_count.
+  Every show is checked against the existing bookings before any is
+  written, and they are inserted together with one multi-row INSERT.
+  If a field is invalid, render the form again with its errors.
+  If the venue or the artist is already booked for part of that time,
+  render home.html with a message naming which one.
   If successful, render home.html with message 'Show was successfully listed!'
   If error, render home.html with message 'An error occured. Show could not
   be listed.'
   '''
 
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
+  form = ShowForm(request.form)
+  if not form.validate():
+    return render_template('forms/new_show.html', form=form)
   try:
-    artist_id = request.form['artist_id']
-    venue_id = request.form['venue_id']
-    start_time = request.form['start_time']
-    new_show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
-    db.session.add(new_show)
+    artist_id = form.artist_id.data
+    venue_id = form.venue_id.data
+    duration = form.duration.data or DEFAULT_SHOW_DURATION
+    start_times = occurrences(form.start_time.data, form.repeat.data,
+      until=form.repeat_until.data, count=form.repeat_count.data)
+
+    conflicts = find_conflicts(venue_id, artist_id, start_times, duration)
+    if len(start_times) == 1 and conflicts:
+      flash('Show could not be listed: the {} is already booked at that time.'.format(conflicts[0][1]))
+      return render_template('pages/home.html')
+    if conflicts:
+      flash('Shows could not be listed: the {} is already booked for {} of the {} dates, the first on {}.'.format(
+        conflicts[0][1], len(conflicts), len(start_times), conflicts[0][0].strftime('%Y-%m-%d')))
+      return render_template('pages/home.html')
+
+    shows = [{
+      'venue_id': venue_id,
+      'artist_id': artist_id,
+      'start_time': start,
+      'duration': duration
+    } for start in start_times]
+    connection = db.session.connection()
+    connection.execute(Show.__table__.insert().values(shows))
+    # the ORM events that keep the counters do not see a Core insert
+    count_shows(connection, shows)
     db.session.commit()
+    response_cache.invalidate()
+    announce_listed_shows(venue_id, start_times)
     # on successful db insert, flash success
-    flash('Show was successfully listed!')
+    if len(shows) == 1:
+      flash('Show was successfully listed!')
+    else:
+      flash('{} shows were successfully listed!'.format(len(shows)))
+  except IntegrityError as error:
+    db.session.rollback()
+    # a concurrent booking got there first
+    if is_booking_conflict(error):
+      flash('Show could not be listed: the venue or artist is already booked at that time.')
+    else:
+      flash('An error occurred. Show could not be listed.')
+  except RecurrenceError as error:
+    db.session.rollback()
+    flash('Show could not be listed: {}'.format(error))
   except:
     db.session.rollback()
-    # TODO: on unsuccessful db insert, flash an error instead.
     flash('An error occurred. Show could not be listed.')
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   finally:
     db.session.close()
   return render_template('pages/home.html')
 
+#  Matches
+#  ----------------------------------------------------------------
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  '''
+  Rank the venues seeking talent for artist <artist_id> by shared genres,
+  locality and past shows together
+
+  Return: render 'matches.html' with at most MATCHES_LIMIT venues, best
+  first, or 404 if there is no such artist
+  '''
+  artist = Artist.query.get_or_404(artist_id)
+  matches = find_matches(artist, app.config['MATCHES_LIMIT'])
+  return render_template('pages/matches.html', subject=artist, kind='venues', matches=matches)
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  '''
+  Rank the artists seeking a venue for venue <venue_id> by shared genres,
+  locality and past shows together
+
+  Return: render 'matches.html' with at most MATCHES_LIMIT artists, best
+  first, or 404 if there is no such venue
+  '''
+  venue = Venue.query.get_or_404(venue_id)
+  matches = find_matches(venue, app.config['MATCHES_LIMIT'])
+  return render_template('pages/matches.html', subject=venue, kind='artists', matches=matches)
+
+#  Calendars
+#  ----------------------------------------------------------------
+#  iCalendar feeds of the shows of a venue or an artist, for calendar
+#  clients to subscribe to. They are streamed from a server-side cursor,
+#  and a client whose If-Modified-Since is no older than the last change to
+#  the shows gets a 304 without them being read, see calendars.py.
+
+def iter_show_events(condition):
+  '''
+  Yield the shows matching condition as calendar events, in order of start
+  time. Rows are read from a server-side cursor in batches of
+  STREAM_BATCH_SIZE.
+  '''
+  rows = db.session.query(
+      Show.id, Show.venue_id, Show.start_time, Show.duration,
+      Artist.name.label('artist_name'), Venue.name.label('venue_name'),
+      Venue.address, Venue.city, Venue.state
+    ).join(Artist, Show.artist_id==Artist.id).join(Venue, Show.venue_id==Venue.id
+    ).filter(condition).order_by(Show.start_time, Show.id
+    ).yield_per(app.config['STREAM_BATCH_SIZE'])
+  for show in rows:
+    yield {
+      "uid": 'show-{}@fyyur'.format(show.id),
+      "start": show.start_time,
+      "end": show.start_time + timedelta(minutes=show.duration),
+      "summary": '{} at {}'.format(show.artist_name, show.venue_name),
+      "location": ', '.join(part for part in (show.venue_name, show.address, show.city, show.state) if part),
+      "url": url_for('show_venue', venue_id=show.venue_id, _external=True)
+    }
+
+def calendar_response(name, changed_at, condition):
+  '''
+  Return the calendar called name of the shows matching condition, or a
+  304 if they have not changed since If-Modified-Since; changed_at is when
+  they last changed
+  '''
+  modified = last_modified(changed_at)
+  if is_modified(modified, request.if_modified_since):
+    response = Response(stream_with_context(iter_calendar(name, iter_show_events(condition))),
+                        mimetype='text/calendar')
+  else:
+    response = Response(status=304)
+  if modified is not None:
+    response.last_modified = modified
+  response.headers['Cache-Control'] = 'no-cache'
+  return response
+
+@app.route('/venues/<int:venue_id>/calendar.ics')
+def venue_calendar(venue_id):
+  '''
+  Expected client input: optionally an If-Modified-Since header
+
+  Return: the shows of venue <venue_id> as an iCalendar feed, 304 if they
+  have not changed since If-Modified-Since, or 404 if there is no such venue
+  '''
+  venue = Venue.query.get_or_404(venue_id)
+  return calendar_response(venue.name, venue.shows_changed_at, Show.venue_id==venue_id)
+
+@app.route('/artists/<int:artist_id>/calendar.ics')
+def artist_calendar(artist_id):
+  '''
+  Expected client input: optionally an If-Modified-Since header
+
+  Return: the shows of artist <artist_id> as an iCalendar feed, 304 if they
+  have not changed since If-Modified-Since, or 404 if there is no such artist
+  '''
+  artist = Artist.query.get_or_404(artist_id)
+  return calendar_response(artist.name, artist.shows_changed_at, Show.artist_id==artist_id)
+
+#  API
+#  ----------------------------------------------------------------
+#  JSON versions of the listing and detail pages. Every response carries
+#  an ETag, and a request whose If-None-Match still matches it gets a 304
+#  without the view running, see etags.py.
+
+@app.route('/api/venues')
+@etagged
+@response_cache.cached
+def api_venues():
+  '''
+  List venues grouped by city location, as on /venues
+
+  Expected client input: optional genre
+  Return: {"areas": [{"city", "state", "venues": [{"id", "name", "num_upcoming_shows"}]}]}
+  '''
+  return jsonify({'areas': venue_areas(request.args.get('genre'))})
+
+@app.route('/api/venues/<int:venue_id>')
+@etagged
+@response_cache.cached
+def api_venue(venue_id):
+  '''
+  Details of venue <venue_id>, as on /venues/<venue_id>
+
+  Return: the venue fields, its past_shows and upcoming_shows and their
+  counts, or 404 if there is no such venue
+  '''
+  return jsonify(venue_details(venue_id))
+
+@app.route('/api/artists')
+@etagged
+@response_cache.cached
+def api_artists():
+  '''
+  List artists ordered by name, as on /artists
+
+  Expected client input: optional genre
+  Return: {"artists": [{"id", "name"}]}
+  '''
+  return jsonify({'artists': list(iter_artists(request.args.get('genre')))})
+
+@app.route('/api/artists/<int:artist_id>')
+@etagged
+@response_cache.cached
+def api_artist(artist_id):
+  '''
+  Details of artist <artist_id>, as on /artists/<artist_id>
+
+  Return: the artist fields, its past_shows and upcoming_shows and their
+  counts, or 404 if there is no such artist
+  '''
+  return jsonify(artist_details(artist_id))
+
+@app.route('/api/shows')
+@etagged
+@response_cache.cached
+def api_shows():
+  '''
+  One page of shows ordered by start time, as on /shows
+
+  Expected client input: optional page cursor, either after or before
+  Return: {"shows": [...], "prev": cursor or null, "next": cursor or null}
+  '''
+  shows, prev_cursor, next_cursor = paginate_shows(
+    after=request.args.get('after'),
+    before=request.args.get('before'))
+  return jsonify({
+    'shows': [show_details(show) for show in shows],
+    'prev': prev_cursor,
+    'next': next_cursor
+  })
+
+@app.route('/api/shows/<int:show_id>')
+@etagged
+@response_cache.cached
+def api_show(show_id):
+  '''
+  Details of show <show_id>
+
+  Return: {"id", "venue_id", "venue_name", "artist_id", "artist_name",
+  "artist_image_link", "start_time", "duration"}, or 404 if there is no
+  such show
+  '''
+  show = Show.query.options(db.joinedload(Show.venue), db.joinedload(Show.artist)
+    ).filter_by(id=show_id).first_or_404()
+  return jsonify(show_details(show))
+
+#  Internal
+#  ----------------------------------------------------------------
+
+def internal_only(view):
+  '''Hide view from every client outside INTERNAL_HOSTS.'''
+  @wraps(view)
+  def decorated(*args, **kwargs):
+    if request.remote_addr not in app.config['INTERNAL_HOSTS']:
+      abort(404)
+    return view(*args, **kwargs)
+  return decorated
+
+@app.route('/internal/pool')
+@internal_only
+def internal_pool():
+  '''
+  Report the state of this worker's database connection pool
+
+  Return: size, checked_in, checked_out and overflow connections, and the
+  number of checkouts with their average and maximum wait in milliseconds
+  '''
+  return jsonify(pool_status(db.engine.pool))
+
+@app.route('/internal/queries')
+@internal_only
+def internal_queries():
+  '''
+  Report the SQL statistics of this worker per route
+
+  Return: for every endpoint, the number of requests, histograms of their
+  query count and database time in milliseconds, and the slowest statement
+  '''
+  return jsonify(query_stats.to_dict())
+
+@app.route('/internal/jobs')
+@internal_only
+def internal_jobs():
+  '''
+  Report the background job queue
+
+  Return: the number of queued, running, done and failed jobs, how long
+  the oldest due job has waited in seconds, the last failures with their
+  error, and this worker's job threads and how many are busy
+  '''
+  return jsonify(jobs.status())
+
+#  Commands
+#  ----------------------------------------------------------------
+
+def invalidate_from_command():
+  '''
+  Invalidate the response cache after a command wrote to the database,
+  warning when the web workers can not see it
+  '''
+  response_cache.invalidate()
+  if not response_cache.backend.shared:
+    click.echo('The web workers cache pages in memory and serve them for up to {} more seconds;'
+      ' set RESPONSE_CACHE=filesystem to refresh them right away.'.format(
+        app.config['RESPONSE_CACHE_TTL']), err=True)
+
+def lift_statement_timeout(dbapi_connection, connection_record):
+  cursor = dbapi_connection.cursor()
+  cursor.execute('SET statement_timeout = 0')
+  cursor.close()
+  # a SET rolled back with the transaction it ran in would not stick
+  dbapi_connection.commit()
+
+def without_statement_timeout(command):
+  '''
+  Run command on connections without DB_STATEMENT_TIMEOUT, which is meant
+  for web requests, not for maintenance that reads every show
+  '''
+  @wraps(command)
+  def decorated(*args, **kwargs):
+    engine = db.engine
+    event.listen(engine, 'connect', lift_statement_timeout)
+    # connections opened with the timeout are not used again
+    db.session.remove()
+    engine.dispose()
+    try:
+      return command(*args, **kwargs)
+    finally:
+      event.remove(engine, 'connect', lift_statement_timeout)
+      db.session.remove()
+      engine.dispose()
+  return decorated
+
+#  Background jobs
+#  ----------------------------------------------------------------
+
+@app.cli.command('run-jobs')
+def run_jobs_command():
+  '''Run the due background jobs, for when JOBS_WORKERS is 0. Run it from cron or a loop.'''
+  print('{} jobs run.'.format(jobs.run_pending()))
+
+#  Show counters
+#  ----------------------------------------------------------------
+
+@app.cli.command('rollover-shows')
+@without_statement_timeout
+def rollover_shows_command():
+  '''Move shows that have started from the upcoming to the past counters. Run it from cron.'''
+  moved = roll_over_shows()
+  if moved:
+    invalidate_from_command()
+  print('{} shows rolled over.'.format(moved))
+
+@app.cli.command('recount-shows')
+@without_statement_timeout
+def recount_shows_command():
+  '''Recompute every venue and artist show counter from scratch.'''
+  recount_shows()
+  invalidate_from_command()
+  print('Show counters recomputed.')
+
+#  Static assets
+#  ----------------------------------------------------------------
+
+@app.cli.command('build-assets')
+def build_assets_command():
+  '''Write fingerprinted, precompressed copies of the static files. Run it on deploy.'''
+  assets.manifest = build_assets(app.static_folder, app.config['ASSETS_BUILD_DIR'])
+  print('{} static files built.'.format(len(assets.manifest)))
+
+#  Bulk import
+#  ----------------------------------------------------------------
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(LOADERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--chunk-size', type=int, help='Rows per transaction, IMPORT_CHUNK_SIZE by default.')
+@without_statement_timeout
+def import_command(kind, path, format, chunk_size):
+  '''
+  Import venues, artists or shows from a CSV or NDJSON file.
+
+  Rows are validated like the create forms; invalid rows are reported on
+  stderr with their line number and skipped.
+  '''
+  def report(line_numbers, errors):
+    if len(line_numbers) == 1:
+      lines = 'line {}'.format(line_numbers[0])
+    else:
+      lines = 'lines {}-{}'.format(line_numbers[0], line_numbers[-1])
+    for field, messages in errors.items():
+      click.echo('{}: {}: {}'.format(lines, field, ' '.join(messages)), err=True)
+
+  result = import_file(kind, path, format,
+    chunk_size or app.config['IMPORT_CHUNK_SIZE'], on_error=report)
+  if result.imported:
+    invalidate_from_command()
+  click.echo('{} {} imported, {} rejected.'.format(result.imported, kind, result.rejected))
+
 @app.errorhandler(404)
 def not_found_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'error': 404, 'message': 'resource not found'}), 404
     return render_template('errors/404.html'), 404
 
 @app.errorhandler(500)
@@ -580,13 +1277,7 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    setup_logging(app)
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
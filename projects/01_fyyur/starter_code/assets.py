@@ -0,0 +1,166 @@
+'''
+Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies every file under static/ into the
+ASSETS_BUILD_DIR subfolder with a hash of its content in the name, so
+css/main.css becomes dist/css/main.1a2b3c4d5e.css. It points the url()
+references of stylesheets at the copies, writes gzip variants of the files
+worth compressing (and brotli ones when the brotli package is installed),
+and records the original and fingerprinted paths in a manifest.
+
+When the manifest exists, Assets makes url_for('static', filename=...)
+return the fingerprinted path and serves those files with a far-future,
+immutable Cache-Control, choosing the precompressed variant the client
+accepts. A changed file gets a new name, so browsers never revalidate the
+old one. Copies from earlier builds are kept, for pages rendered before a
+deploy.
+'''
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory
+from flask.helpers import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 10
+
+# images and fonts like woff are compressed already
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.ttf', '.otf', '.eot')
+
+# preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def fingerprint(path, content):
+    '''Return path with a hash of content inserted before its extension.'''
+    root, ext = posixpath.splitext(path)
+    return '{}.{}{}'.format(root, hashlib.sha256(content).hexdigest()[:HASH_LENGTH], ext)
+
+
+def rewrite_css_urls(path, content, manifest):
+    '''
+    Point the relative url() references of the stylesheet at path to the
+    fingerprinted copies listed in manifest, keeping any query or fragment.
+    '''
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.groups()
+        target, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        if not target or target.startswith('/') or ':' in target:
+            return match.group(0)
+        hashed = manifest.get(posixpath.normpath(posixpath.join(directory, target)))
+        if hashed is None:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(hashed, directory), suffix)
+
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def compress(content):
+    '''Yield (suffix, data) for each precompressed variant worth keeping.'''
+    variants = [('.gz', gzip.compress(content, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+    for suffix, data in variants:
+        if len(data) < len(content):
+            yield suffix, data
+
+
+def build_assets(static_folder, build_dir):
+    '''
+    Write fingerprinted and precompressed copies of the files under
+    static_folder to its build_dir subfolder and return the manifest.
+    '''
+    output = os.path.join(static_folder, build_dir)
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) != output]
+        for name in files:
+            if not name.startswith('.'):
+                sources.append(os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/'))
+    # stylesheets last, so the files they reference already have their names
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = rewrite_css_urls(path, content, manifest)
+        manifest[path] = hashed = fingerprint(path, content)
+
+        target = os.path.join(output, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        variants = [('', content)]
+        if posixpath.splitext(path)[1].lower() in COMPRESSIBLE:
+            variants.extend(compress(content))
+        for suffix, data in variants:
+            with open(target + suffix, 'wb') as f:
+                f.write(data)
+
+    with open(os.path.join(output, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets:
+    '''Serves the fingerprinted copies written by build_assets.'''
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.build_dir = app.config.get('ASSETS_BUILD_DIR', 'dist')
+        self.max_age = app.config.get('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        self.load()
+        app.url_defaults(self._fingerprint_url)
+        self.send_static_file = app.view_functions['static']
+        app.view_functions['static'] = self.serve
+
+    def load(self):
+        '''Read the manifest of the last build, if there is one.'''
+        try:
+            with open(os.path.join(self.static_folder, self.build_dir, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def _fingerprint_url(self, endpoint, values):
+        if endpoint == 'static':
+            hashed = self.manifest.get(values.get('filename'))
+            if hashed is not None:
+                values['filename'] = posixpath.join(self.build_dir, hashed)
+
+    def serve(self, filename):
+        if not filename.startswith(self.build_dir + '/'):
+            return self.send_static_file(filename=filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and \
+                    os.path.isfile(safe_join(self.static_folder, filename + suffix)):
+                response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.static_folder, filename, mimetype=mimetype)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # the name changes with the content, so it never needs revalidating
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(self.max_age)
+        return response
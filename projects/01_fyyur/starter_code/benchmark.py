@@ -0,0 +1,188 @@
+'''
+Benchmarks for Fyyur's hot pages.
+
+Database benchmarks seed their data inside a transaction on the configured
+database and roll it back when they are done, so they can be pointed at a
+development database without leaving rows behind.
+
+Usage:
+  python benchmark.py venues --venues 10000 --cities 2000
+  python benchmark.py datetime --rows 100000 --distinct 5000
+'''
+import argparse
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+from sqlalchemy import event
+
+from app import app, venue_areas
+from formatters import format_datetime, _format_datetime
+from models import db, Venue, Artist, Show
+
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+class QueryCounter:
+    '''Count the statements sent to the database while active.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+
+def measure(label, func, repeat=3):
+    '''Run func repeat times and print the best latency and its query count.'''
+    best = None
+    for _ in range(repeat):
+        with QueryCounter(db.engine) as counter:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, counter.count)
+    print('{:<10} {:>8} queries {:>10.1f} ms'.format(label, best[1], best[0] * 1000))
+
+
+@contextmanager
+def seeded(seed):
+    '''Seed data with seed() and roll everything back afterwards.'''
+    db.create_all()
+    try:
+        seed()
+        db.session.flush()
+        yield
+    finally:
+        db.session.rollback()
+
+
+#----------------------------------------------------------------------------#
+# Venues.
+#----------------------------------------------------------------------------#
+
+def legacy_venue_areas():
+    '''The original /venues implementation: one query per city.'''
+    data=[]
+    cities = Venue.query.distinct(Venue.city, Venue.state).order_by('state').all()
+    for city in cities:
+        venues_list=[]
+        venues = Venue.query.filter_by(city=city.city, state=city.state).order_by('id').all()
+        for venue in venues:
+            venues_list.append({
+                "id": venue.id,
+                "name": venue.name
+            })
+        data.append({
+            "city": city.city,
+            "state": city.state,
+            "venues": venues_list
+        })
+    return data
+
+
+def seed_venues(num_venues, num_cities, shows_per_venue=2):
+    states = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'OR', 'MA']
+    cities = [('City {}'.format(i), states[i % len(states)]) for i in range(num_cities)]
+    db.session.bulk_insert_mappings(Venue, [{
+        'name': 'Venue {}'.format(i),
+        'city': cities[i % num_cities][0],
+        'state': cities[i % num_cities][1],
+    } for i in range(num_venues)])
+    db.session.bulk_insert_mappings(Artist, [{
+        'name': 'Benchmark Artist {}'.format(i),
+    } for i in range(num_venues)])
+    db.session.flush()
+    venue_ids = [venue_id for venue_id, in db.session.query(Venue.id).order_by(Venue.id)]
+    artist_ids = [artist_id for artist_id, in db.session.query(Artist.id).order_by(Artist.id)]
+    now = datetime.now()
+    # no venue or artist may be booked twice at once, so each venue plays
+    # with an artist of its own, on different days
+    db.session.bulk_insert_mappings(Show, [{
+        'venue_id': venue_id,
+        'artist_id': artist_id,
+        'start_time': now + timedelta(days=day),
+    } for venue_id, artist_id in zip(venue_ids[-num_venues:], artist_ids[-num_venues:])
+      for day in random.sample(range(-365, 366), shows_per_venue)])
+
+
+def bench_venues(args):
+    with seeded(lambda: seed_venues(args.venues, args.cities)):
+        measure('before', legacy_venue_areas, args.repeat)
+        measure('after', venue_areas, args.repeat)
+
+
+#----------------------------------------------------------------------------#
+# Datetime filter.
+#----------------------------------------------------------------------------#
+
+def legacy_format_datetime(value, format='medium'):
+    '''The original datetime filter, fed str(show.start_time).'''
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format="EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format="EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def bench_datetime(args):
+    start = datetime(2020, 1, 1, 20, 0)
+    values = [start + timedelta(hours=random.randrange(args.distinct))
+              for _ in range(args.rows)]
+    assert legacy_format_datetime(str(values[0]), 'full') == format_datetime(values[0], 'full')
+
+    def before():
+        for value in values:
+            legacy_format_datetime(str(value), 'full')
+
+    def after():
+        _format_datetime.cache_clear()
+        for value in values:
+            format_datetime(value, 'full')
+
+    print('{} rows, {} distinct start times'.format(args.rows, args.distinct))
+    for label, func in (('before', before), ('after', after)):
+        best = None
+        for _ in range(args.repeat):
+            elapsed = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - elapsed
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:<10} {:>10.1f} ms {:>8.2f} us/row'.format(label, best * 1000, best / args.rows * 1e6))
+
+
+#----------------------------------------------------------------------------#
+# Launch.
+#----------------------------------------------------------------------------#
+
+BENCHMARKS = {
+    'datetime': bench_datetime,
+    'venues': bench_venues,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fyyur benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--cities', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with app.app_context():
+        BENCHMARKS[args.benchmark](args)
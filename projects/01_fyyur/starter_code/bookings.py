@@ -0,0 +1,157 @@
+'''
+Double-booking checks for shows.
+
+A show books its venue and its artist from start_time for duration
+minutes, and no two bookings of the same venue or artist may overlap. The
+ex_Show_venue_booking and ex_Show_artist_booking exclusion constraints
+enforce this in the database.
+
+Before listing a show, or every show of a recurring one, find_conflicts()
+probes the venue's and the artist's bookings over the window of each
+start time, through the GiST indexes of those constraints, so the
+handler can say which one is booked instead of failing on the constraint.
+The work grows with the number of start times, not with the bookings
+around them.
+
+IntervalIndex does the same lookups in memory, for checking the rows of
+an import against each other before they are written.
+'''
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from models import db, SHOW_TIME_RANGE, id_range
+
+
+class IntervalIndex:
+    '''Disjoint [start, end) intervals per key, sorted by start.'''
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+        self.ids = {}
+
+    def find(self, key, start, end):
+        '''Return the id of an interval of key overlapping [start, end), or None.'''
+        starts = self.starts.get(key)
+        if not starts:
+            return None
+        # the last interval starting before end is the only candidate
+        i = bisect_left(starts, end) - 1
+        if i >= 0 and self.ends[key][i] > start:
+            return self.ids[key][i]
+        return None
+
+    def add(self, key, start, end, id):
+        starts = self.starts.setdefault(key, [])
+        i = bisect_right(starts, start)
+        starts.insert(i, start)
+        self.ends.setdefault(key, []).insert(i, end)
+        self.ids.setdefault(key, []).insert(i, id)
+
+    def remove(self, key, start):
+        '''Remove the interval of key that starts at start.'''
+        i = bisect_left(self.starts[key], start)
+        del self.starts[key][i], self.ends[key][i], self.ids[key][i]
+
+    def add_show(self, id, venue_id, artist_id, start_time, duration):
+        end_time = start_time + timedelta(minutes=duration)
+        self.add(('venue', venue_id), start_time, end_time, id)
+        self.add(('artist', artist_id), start_time, end_time, id)
+
+    def remove_show(self, venue_id, artist_id, start_time):
+        self.remove(('venue', venue_id), start_time)
+        self.remove(('artist', artist_id), start_time)
+
+    def find_show(self, venue_id, artist_id, start_time, duration):
+        '''Return ('venue' or 'artist', id) of a show the booking would overlap.'''
+        end_time = start_time + timedelta(minutes=duration)
+        for kind, key_id in (('venue', venue_id), ('artist', artist_id)):
+            id = self.find((kind, key_id), start_time, end_time)
+            if id is not None:
+                return kind, id
+        return None
+
+
+#----------------------------------------------------------------------------#
+# Recurring shows.
+#----------------------------------------------------------------------------#
+
+# days between the occurrences of a recurring show
+RECURRENCES = {'weekly': 7, 'biweekly': 14}
+MAX_OCCURRENCES = 104
+
+
+class RecurrenceError(ValueError):
+    '''A recurrence that can not be expanded into shows.'''
+
+
+def occurrences(start_time, repeat=None, until=None, count=None):
+    '''
+    Return the start times of a show on start_time, repeated weekly or
+    biweekly up to and including the date until or count times, whichever
+    ends first. Raises RecurrenceError for an unknown repeat, a recurrence
+    without an end, one that ends before its first show, or one of more
+    than MAX_OCCURRENCES shows.
+    '''
+    if not repeat:
+        return [start_time]
+    if repeat not in RECURRENCES:
+        raise RecurrenceError('unknown recurrence {}.'.format(repeat))
+    if until is None and count is None:
+        raise RecurrenceError('a recurring show needs an end date or a number of shows.')
+    step = timedelta(days=RECURRENCES[repeat])
+    start_times = []
+    while count is None or len(start_times) < count:
+        start = start_time + step * len(start_times)
+        if until is not None and start.date() > until:
+            break
+        if len(start_times) == MAX_OCCURRENCES:
+            raise RecurrenceError('a recurring show can have at most {} shows.'.format(MAX_OCCURRENCES))
+        start_times.append(start)
+    if not start_times:
+        raise RecurrenceError('a recurring show can not end before its first show.')
+    return start_times
+
+
+#----------------------------------------------------------------------------#
+# Conflicts.
+#----------------------------------------------------------------------------#
+
+def find_conflicts(venue_id, artist_id, start_times, duration):
+    '''
+    Return (start time, 'venue' or 'artist', show id) for each of
+    start_times at which a booking of venue_id and artist_id would overlap
+    an existing show, in order of start time. Every start time is probed
+    with the expressions of the exclusion constraints, so each probe is a
+    scan of their GiST index over the window it books.
+    '''
+    # a lateral probe per start time, so each is an index scan of its own window
+    probes = ["""
+        SELECT booking.booked_at, {priority} AS priority, '{kind}' AS kind, booked.id
+        FROM unnest(CAST(:start_times AS timestamp[])) AS booking(booked_at)
+        CROSS JOIN LATERAL (
+          SELECT id FROM "Show"
+          WHERE {show_range} && {booked_range}
+            AND {show_time_range} && tsrange(booking.booked_at,
+                                             booking.booked_at + :duration * interval '1 minute')
+          LIMIT 1
+        ) AS booked
+        """.format(priority=priority, kind=kind, show_range=id_range(column),
+                   booked_range=id_range(':' + column), show_time_range=SHOW_TIME_RANGE)
+        for priority, (kind, column) in enumerate((('venue', 'venue_id'), ('artist', 'artist_id')))]
+    rows = db.session.execute(' UNION ALL '.join(probes) + ' ORDER BY booked_at, priority, id', {
+        'start_times': list(start_times),
+        'duration': duration,
+        'venue_id': venue_id,
+        'artist_id': artist_id
+    })
+    conflicts = {}
+    for start_time, _, kind, id in rows:
+        # report the venue first when both are booked
+        conflicts.setdefault(start_time, (start_time, kind, id))
+    return list(conflicts.values())
+
+
+def is_booking_conflict(error):
+    '''Whether an IntegrityError was raised by a double-booking constraint.'''
+    return 'ex_Show_venue_booking' in str(error.orig) or 'ex_Show_artist_booking' in str(error.orig)
@@ -0,0 +1,234 @@
+'''
+Response cache for Fyyur's read pages.
+
+Cached GET responses are keyed by the data version, the endpoint and its
+arguments. Handlers that write call invalidate() after they commit, which
+bumps the version so every cached page is bypassed from then on; old
+entries are left to age out of the LRU or expire with their TTL.
+
+Backends:
+  memory      in-process LRU with a TTL, for a single worker
+  filesystem  pickled entries in RESPONSE_CACHE_DIR, shared by every
+              worker on the host, including the data version
+  null        caching disabled
+
+Only a shared backend lets another process, such as a flask command,
+invalidate the pages the web workers cached; with the memory backend
+they are served until RESPONSE_CACHE_TTL runs out.
+'''
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, g, request, session
+
+
+#----------------------------------------------------------------------------#
+# Backends.
+#----------------------------------------------------------------------------#
+
+class NullCache:
+    '''A backend that never stores anything.'''
+
+    # whether invalidating in one process reaches the others
+    shared = True
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def get_version(self):
+        return 0
+
+    def bump_version(self):
+        pass
+
+
+class MemoryCache:
+    '''An in-process LRU cache whose entries expire after ttl seconds.'''
+
+    shared = False
+
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_version(self):
+        return self.version
+
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+            # nothing can reach the old entries any more
+            self.entries.clear()
+
+
+class FileSystemCache:
+    '''
+    A cache of pickled entries in a directory, shared by every process
+    that points at it. Files are written to a temporary name and renamed
+    into place so readers never see a partial entry.
+    '''
+
+    shared = True
+
+    def __init__(self, directory, ttl=60):
+        self.directory = directory
+        self.ttl = ttl
+        self.version_path = os.path.join(directory, 'version')
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value):
+        self._write(self._path(key), pickle.dumps((time.time() + self.ttl, value)))
+
+    def get_version(self):
+        try:
+            with open(self.version_path) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump_version(self):
+        self._write(self.version_path, str(self.get_version() + 1).encode())
+
+
+def make_backend(config):
+    '''Create the backend named by the RESPONSE_CACHE setting.'''
+    kind = config.get('RESPONSE_CACHE', 'memory')
+    ttl = config.get('RESPONSE_CACHE_TTL', 60)
+    if kind == 'memory':
+        return MemoryCache(config.get('RESPONSE_CACHE_SIZE', 512), ttl)
+    if kind == 'filesystem':
+        return FileSystemCache(config['RESPONSE_CACHE_DIR'], ttl)
+    if kind == 'null':
+        return NullCache()
+    raise ValueError('Unknown RESPONSE_CACHE backend: {}'.format(kind))
+
+
+#----------------------------------------------------------------------------#
+# Flask integration.
+#----------------------------------------------------------------------------#
+
+class ResponseCache:
+    '''Caches the responses of decorated GET views.'''
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config)
+
+    def invalidate(self):
+        '''Make every cached response stale. Call after committing a write.'''
+        self.backend.bump_version()
+
+    def make_key(self):
+        # read the version before the view runs its queries, so a page
+        # rendered from data older than a write is never stored under the
+        # version that write created; views wrapped by etagged() are also
+        # keyed on their ETag, which follows the database's data version
+        args = sorted(request.args.items(multi=True))
+        view_args = sorted((request.view_args or {}).items())
+        return '{}:{}:{}:{}:{}'.format(self.backend.get_version(), g.get('etag', ''),
+                                       request.endpoint, view_args, args)
+
+    def cached(self, view):
+        '''Serve view from the cache, storing successful responses.'''
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            # pages rendered with pending flash messages are one-offs
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            key = self.make_key()
+            entry = self.backend.get(key)
+            if entry is not None:
+                body, status, headers = entry
+                response = Response(body, status=status, headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            response.headers['X-Cache'] = 'MISS'
+            if response.status_code == 200:
+                self._store(key, response)
+            return response
+        return decorated
+
+    def _store(self, key, response):
+        status = response.status_code
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() not in ('set-cookie', 'x-cache')]
+        if not response.is_streamed:
+            self.backend.set(key, (response.get_data(), status, headers))
+            return
+
+        # keep streaming to the client and store the page once it is complete
+        inner = response.response
+        backend = self.backend
+
+        def generate():
+            chunks = []
+            try:
+                for chunk in inner:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode(response.charset)
+                    chunks.append(chunk)
+                    yield chunk
+                backend.set(key, (b''.join(chunks), status, headers))
+            finally:
+                if hasattr(inner, 'close'):
+                    inner.close()
+
+        response.response = generate()
+
@@ -0,0 +1,95 @@
+'''
+iCalendar (RFC 5545) feeds of the shows of a venue or an artist.
+
+iter_calendar() yields the document line by line from an iterable of
+events, so a feed can be streamed straight from a server-side cursor
+without ever holding all of its shows in memory.
+
+Feeds are polled by calendar clients, so they carry a Last-Modified date:
+the time the shows of the venue or artist, or the names and addresses
+they show, last changed, kept in shows_changed_at by counters.py. HTTP
+dates only have whole seconds, so a change less than a second old is
+sent without one; otherwise a second change within the same second could
+go unnoticed.
+'''
+from datetime import datetime, timedelta, timezone
+
+PRODID = '-//Fyyur//Shows//EN'
+
+# lines longer than this many octets are folded
+MAX_LINE_OCTETS = 75
+
+
+def escape(text):
+    '''Escape a TEXT property value.'''
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold(line):
+    '''Fold a content line into CRLF-terminated lines of at most MAX_LINE_OCTETS.'''
+    encoded = line.encode('utf-8')
+    if len(encoded) <= MAX_LINE_OCTETS:
+        return line + '\r\n'
+    parts = []
+    limit = MAX_LINE_OCTETS
+    while encoded:
+        cut = min(limit, len(encoded))
+        # never split a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        # continuation lines start with a space, which counts
+        limit = MAX_LINE_OCTETS - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_datetime(value):
+    '''A naive datetime as an iCalendar floating local time.'''
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def iter_calendar(name, events):
+    '''
+    Yield the lines of a calendar called name. events holds dicts with a
+    uid, start and end datetimes, a summary, and optionally a location and
+    a url.
+    '''
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold('PRODID:' + PRODID)
+    yield fold('CALSCALE:GREGORIAN')
+    yield fold('X-WR-CALNAME:' + escape(name))
+    for event in events:
+        yield fold('BEGIN:VEVENT')
+        yield fold('UID:' + event['uid'])
+        yield fold('DTSTAMP:' + stamp)
+        yield fold('DTSTART:' + format_datetime(event['start']))
+        yield fold('DTEND:' + format_datetime(event['end']))
+        yield fold('SUMMARY:' + escape(event['summary']))
+        if event.get('location'):
+            yield fold('LOCATION:' + escape(event['location']))
+        if event.get('url'):
+            yield fold('URL:' + event['url'])
+        yield fold('END:VEVENT')
+    yield fold('END:VCALENDAR')
+
+
+def last_modified(changed_at, now=None):
+    '''
+    Return the Last-Modified date of a feed whose shows changed at
+    changed_at, a naive local time, as a naive UTC datetime in whole
+    seconds; None if it never changed or changed less than a second ago.
+    '''
+    if changed_at is None:
+        return None
+    now = now or datetime.now()
+    if now - changed_at < timedelta(seconds=1):
+        return None
+    return changed_at.astimezone(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def is_modified(modified, if_modified_since):
+    '''Whether a feed last modified at modified must be sent again.'''
+    return modified is None or if_modified_since is None or modified > if_modified_since
@@ -24,4 +24,103 @@ DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
 DB_NAME = os.getenv('DB_NAME', 'your_db')
 
-SQLALCHEMY_DATABASE_URI= 'postgresql+psycopg2://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
\ No newline at end of file
+SQLALCHEMY_DATABASE_URI= 'postgresql+psycopg2://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
+
+# Upper bound on the number of rows returned by a single search request
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 100))
+
+# Number of shows on each page of /shows
+SHOWS_PER_PAGE = int(os.getenv('SHOWS_PER_PAGE', 30))
+
+# Stream listing pages (/venues, /artists, /shows) to the client while they
+# render, reading rows from a server-side cursor STREAM_BATCH_SIZE at a time
+STREAM_LISTINGS = os.getenv('STREAM_LISTINGS', 'true').lower() == 'true'
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 1000))
+
+# Cache for the read pages: 'memory' (per worker), 'filesystem' (shared by
+# the workers of one host through RESPONSE_CACHE_DIR) or 'null'. Only the
+# filesystem cache is refreshed by writes from flask commands, such as import
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR', os.path.join(basedir, '.cache'))
+
+# Rows written per transaction by `flask import`
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 10000))
+
+# Connection pool of each worker. Connections are checked with a ping
+# before use and replaced after DB_POOL_RECYCLE seconds; the server cancels
+# statements running longer than DB_STATEMENT_TIMEOUT milliseconds (0 turns
+# the timeout off). The maintenance commands, such as flask import and
+# flask recount-shows, run without it
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 30000))
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+    # passed to libpq, which sets it on every new connection
+    'connect_args': {'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT)},
+}
+
+# Clients allowed to read the /internal/ endpoints
+INTERNAL_HOSTS = os.getenv('INTERNAL_HOSTS', '127.0.0.1,::1').split(',')
+
+# Per-route SQL statistics, reported by /internal/queries. A request running
+# the same statement more than QUERY_REPEAT_THRESHOLD times is logged as a
+# likely N+1 query
+QUERY_STATS = os.getenv('QUERY_STATS', 'true').lower() == 'true'
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', 10))
+
+# Application log, written by a background thread. LOG_ROTATE is 'size'
+# (LOG_MAX_BYTES per file) or 'time' (a new file every LOG_ROTATE_WHEN, as
+# understood by TimedRotatingFileHandler); LOG_FORMAT is 'text' or 'json'
+LOG_FILE = os.getenv('LOG_FILE', os.path.join(basedir, 'error.log'))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_ROTATE = os.getenv('LOG_ROTATE', 'size')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+# log every request with its route, status and duration
+LOG_REQUESTS = os.getenv('LOG_REQUESTS', 'true').lower() == 'true'
+
+# Fingerprinted, precompressed copies of static/, written to this subfolder
+# of static/ by `flask build-assets` and served with a Cache-Control max-age
+# of ASSETS_MAX_AGE seconds
+ASSETS_BUILD_DIR = os.getenv('ASSETS_BUILD_DIR', 'dist')
+ASSETS_MAX_AGE = int(os.getenv('ASSETS_MAX_AGE', 365 * 24 * 3600))
+
+# Number of matches listed on the matchmaking pages
+MATCHES_LIMIT = int(os.getenv('MATCHES_LIMIT', 20))
+
+# Live feed of new shows at /shows/live. LIVE_BUS is 'memory' (the clients
+# of the worker that listed the show only) or 'socket' (every worker of the
+# host, through Unix sockets in LIVE_BUS_DIR). A client more than
+# LIVE_QUEUE_SIZE events behind is disconnected and catches up when it
+# reconnects; idle streams get a keepalive every LIVE_KEEPALIVE seconds
+LIVE_BUS = os.getenv('LIVE_BUS', 'memory')
+LIVE_BUS_DIR = os.getenv('LIVE_BUS_DIR', '')
+LIVE_QUEUE_SIZE = int(os.getenv('LIVE_QUEUE_SIZE', 100))
+LIVE_KEEPALIVE = int(os.getenv('LIVE_KEEPALIVE', 15))
+
+# Background jobs for the side effects of writes, kept in the SQLite
+# database JOBS_DB and run by JOBS_WORKERS threads per worker (0 leaves
+# them to `flask run-jobs`). A failed job is retried after JOBS_BACKOFF
+# seconds, doubling each time, until it has run JOBS_MAX_ATTEMPTS times; a
+# job is taken over by another worker once it has run for JOBS_LEASE
+# seconds. Finished jobs are kept JOBS_RETENTION seconds for /internal/jobs
+JOBS_DB = os.getenv('JOBS_DB', os.path.join(basedir, 'jobs.sqlite3'))
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', 5))
+JOBS_BACKOFF = float(os.getenv('JOBS_BACKOFF', 5))
+JOBS_LEASE = int(os.getenv('JOBS_LEASE', 300))
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+JOBS_RETENTION = int(os.getenv('JOBS_RETENTION', 24 * 3600))
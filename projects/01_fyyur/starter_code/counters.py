@@ -0,0 +1,193 @@
+'''
+Maintained upcoming and past show counters on Venue and Artist.
+
+Each Venue and Artist row carries upcoming_shows_count and
+past_shows_count, so listings can read them straight off the row. A show
+counts as upcoming when it starts at or after the watermark stored in
+ShowCounterState.rolled_until, which the roll-over job advances to the
+current time: it moves the shows that started since the last run from
+the upcoming to the past counters.
+
+Inserting or deleting a Show through the ORM adjusts the counters of its
+venue and artist in the same transaction, and sets their shows_changed_at
+to the current time for the calendar feeds. Writes that bypass the ORM must
+keep the counters up to date themselves with count_shows() or
+uncount_shows(), or call recount_shows(). The feeds also show the names
+and addresses of venues and artists, so editing one calls shows_changed().
+'''
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db, Venue, Artist, Show, ShowCounterState
+
+COUNTED = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+
+def _rolled_until(connection, for_update=False):
+    '''
+    Read the watermark, locking the state row so the roll-over job and
+    counter updates never interleave.
+    '''
+    query = db.select([ShowCounterState.rolled_until]).where(ShowCounterState.id==1)
+    return connection.execute(query.with_for_update(read=not for_update)).scalar()
+
+
+def rolled_until_column():
+    '''
+    The watermark as a column, so pages that split shows into upcoming
+    and past the way the counters do can read it along with their rows.
+    '''
+    return db.select([ShowCounterState.rolled_until]).where(
+        ShowCounterState.id==1).label('rolled_until')
+
+
+def _adjust(connection, show, step):
+    now = datetime.now()
+    rolled_until = _rolled_until(connection) or now
+    start_time = db.literal(show.start_time, type_=Show.start_time.type)
+    upcoming = db.case([(start_time >= rolled_until, step)], else_=0)
+    past = db.case([(start_time >= rolled_until, 0)], else_=step)
+    for model, show_fk in COUNTED:
+        connection.execute(model.__table__.update().where(
+            model.id==getattr(show, show_fk.key)
+          ).values(
+            upcoming_shows_count=model.upcoming_shows_count + upcoming,
+            past_shows_count=model.past_shows_count + past,
+            shows_changed_at=now
+          ))
+
+
+@event.listens_for(Show, 'after_insert')
+def _count_new_show(mapper, connection, target):
+    _adjust(connection, target, 1)
+
+
+@event.listens_for(Show, 'after_delete')
+def _uncount_deleted_show(mapper, connection, target):
+    _adjust(connection, target, -1)
+
+
+def count_shows(connection, shows):
+    '''
+    Add shows written without the ORM, such as a bulk import, to the
+    counters of their venues and artists. shows holds dicts with venue_id,
+    artist_id and start_time; each venue and artist is updated once.
+    '''
+    now = datetime.now()
+    rolled_until = _rolled_until(connection) or now
+    for model, show_fk in COUNTED:
+        counts = defaultdict(lambda: [0, 0])
+        for show in shows:
+            counts[show[show_fk.key]][show['start_time'] < rolled_until] += 1
+        if not counts:
+            continue
+        connection.execute(model.__table__.update().where(
+            model.id==db.bindparam('counted_id')
+          ).values(
+            upcoming_shows_count=model.upcoming_shows_count + db.bindparam('upcoming'),
+            past_shows_count=model.past_shows_count + db.bindparam('past'),
+            shows_changed_at=db.bindparam('changed_at')
+          ), [{'counted_id': id, 'upcoming': upcoming, 'past': past, 'changed_at': now}
+              for id, (upcoming, past) in counts.items()])
+
+
+def uncount_shows(connection, condition):
+    '''
+    Remove the shows matching condition from the counters of their venues
+    and artists, before they are deleted with a set-based DELETE. Runs one
+    grouped UPDATE per counted table, whatever the number of shows.
+    '''
+    now = datetime.now()
+    rolled_until = _rolled_until(connection) or now
+    upcoming = db.case([(Show.start_time >= rolled_until, 1)], else_=0)
+    past = db.case([(Show.start_time >= rolled_until, 0)], else_=1)
+    for model, show_fk in COUNTED:
+        counts = db.select([
+            show_fk.label('id'),
+            db.func.sum(upcoming).label('upcoming'),
+            db.func.sum(past).label('past')
+          ]).where(condition).group_by(show_fk).alias()
+        connection.execute(model.__table__.update().where(
+            model.id==counts.c.id
+          ).values(
+            upcoming_shows_count=model.upcoming_shows_count - counts.c.upcoming,
+            past_shows_count=model.past_shows_count - counts.c.past,
+            shows_changed_at=now
+          ))
+
+
+def shows_changed(record, now=None):
+    '''
+    Set shows_changed_at of record, an edited Venue or Artist, and of every
+    artist or venue it has shows with, whose feeds list it too. The record
+    is updated with its other changes; the others in the same transaction.
+    '''
+    now = now or datetime.now()
+    record.shows_changed_at = now
+    show_fk = dict(COUNTED)[type(record)]
+    connection = db.session.connection()
+    for model, other_fk in COUNTED:
+        if model is type(record):
+            continue
+        connection.execute(model.__table__.update().where(
+            model.id.in_(db.select([other_fk]).where(show_fk==record.id))
+          ).values(shows_changed_at=now))
+
+
+def roll_over_shows(now=None):
+    '''
+    Move the shows that started since the last run from the upcoming to
+    the past counters and advance the watermark to now. Only the shows in
+    that window are read, through the start_time index. Returns the
+    number of shows moved.
+    '''
+    now = now or datetime.now()
+    connection = db.session.connection()
+    rolled_until = _rolled_until(connection, for_update=True)
+    if rolled_until is None:
+        recount_shows(now)
+        return 0
+    if rolled_until >= now:
+        db.session.commit()
+        return 0
+
+    started = db.and_(Show.start_time>=rolled_until, Show.start_time<now)
+    moved = connection.execute(db.select([db.func.count()]).where(started)).scalar()
+    for model, show_fk in COUNTED:
+        counts = db.select([show_fk.label('id'), db.func.count().label('shows')]
+          ).where(started).group_by(show_fk).alias()
+        connection.execute(model.__table__.update().where(
+            model.id==counts.c.id
+          ).values(
+            upcoming_shows_count=model.upcoming_shows_count - counts.c.shows,
+            past_shows_count=model.past_shows_count + counts.c.shows
+          ))
+    connection.execute(ShowCounterState.__table__.update().where(
+        ShowCounterState.id==1).values(rolled_until=now))
+    db.session.commit()
+    return moved
+
+
+def recount_shows(now=None):
+    '''
+    Recompute every counter from the Show table and reset the watermark to
+    now. This reads every show, so it is meant for repairs and for writes
+    that bypass the ORM, not for regular use.
+    '''
+    now = now or datetime.now()
+    connection = db.session.connection()
+    if _rolled_until(connection, for_update=True) is None:
+        connection.execute(ShowCounterState.__table__.insert().values(id=1, rolled_until=now))
+    for model, show_fk in COUNTED:
+        def count(condition):
+            return db.select([db.func.count()]).where(
+                db.and_(show_fk==model.id, condition)).as_scalar()
+        connection.execute(model.__table__.update().values(
+            upcoming_shows_count=count(Show.start_time>=now),
+            past_shows_count=count(Show.start_time<now)
+        ))
+    connection.execute(ShowCounterState.__table__.update().where(
+        ShowCounterState.id==1).values(rolled_until=now))
+    db.session.commit()
@@ -0,0 +1,86 @@
+'''
+Connection pool instrumentation.
+
+TimedQueuePool is SQLAlchemy's QueuePool plus a record of how long each
+checkout waited for a connection and how many gave up after pool_timeout.
+It times the public checkout methods: Pool.connect(), used by sessions,
+and Pool.unique_connection(), used by Engine.connect() on SQLAlchemy 1.3.
+The wait includes the pre-ping and any reconnect. pool_status() reports
+it together with the pool's own counters for the /internal/pool
+endpoint. A checkout that times out is logged with the pool's state,
+since that is the moment the numbers matter.
+'''
+import logging
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutStats:
+    '''Running totals of checkout wait times, in seconds.'''
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, wait, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+
+class TimedQueuePool(QueuePool):
+    '''A QueuePool that records how long checkouts wait.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats = CheckoutStats()
+
+    def _timed(self, checkout):
+        start = time.perf_counter()
+        try:
+            connection = checkout()
+        except exc.TimeoutError:
+            self.checkout_stats.add(time.perf_counter() - start, timed_out=True)
+            logger.warning('Timed out waiting for a database connection: %s', self.status())
+            raise
+        self.checkout_stats.add(time.perf_counter() - start)
+        return connection
+
+    def connect(self):
+        return self._timed(super().connect)
+
+    def unique_connection(self):
+        return self._timed(super().unique_connection)
+
+
+def pool_status(pool):
+    '''Return the state of a pool as a dict; wait times are in milliseconds.'''
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            # negative while the pool has not opened pool_size connections yet
+            'overflow': pool.overflow(),
+        })
+    stats = getattr(pool, 'checkout_stats', None)
+    if stats is not None:
+        with stats.lock:
+            status.update({
+                'checkouts': stats.checkouts,
+                'timeouts': stats.timeouts,
+                'avg_wait_ms': round(stats.total_wait / stats.checkouts * 1000, 3) if stats.checkouts else 0,
+                'max_wait_ms': round(stats.max_wait * 1000, 3),
+            })
+    return status
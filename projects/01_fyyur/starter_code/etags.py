@@ -0,0 +1,52 @@
+'''
+Conditional GET for the JSON API.
+
+The database keeps one version of the data in Venue, Artist and Show,
+bumped when a transaction that wrote to them commits (see
+models.DataVersion). A view decorated with etagged() first reads it,
+together with the show counter watermark that the upcoming and past
+splits follow, and derives its ETag from them and the request URL. A
+request whose If-None-Match holds that ETag is answered with 304 right
+away, without the view running its queries or serializing anything.
+
+The version is read before the view's queries, so a response never
+carries the ETag of data newer than itself. The ETag is also left in
+flask.g.etag, which the response cache adds to its keys: a cached body
+is only served again with the ETag it was rendered under, whichever
+process wrote to the database since.
+'''
+import hashlib
+from functools import wraps
+
+from flask import Response, current_app, g, request
+
+from models import db, DataVersion, ShowCounterState
+
+
+def current_etag():
+    '''Return the ETag of the requested URL at the current data version.'''
+    versions = db.session.query(
+        db.select([DataVersion.version]).where(DataVersion.id==1).as_scalar(),
+        db.select([ShowCounterState.rolled_until]).where(ShowCounterState.id==1).as_scalar()
+    ).one()
+    key = repr((tuple(versions), request.path, sorted(request.args.items(multi=True))))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def etagged(view):
+    '''Tag the responses of view with an ETag and answer If-None-Match.'''
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        etag = g.etag = current_etag()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        # the upcoming and past splits move with the clock between
+        # roll-overs, so the same tag only promises equivalent data
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return decorated
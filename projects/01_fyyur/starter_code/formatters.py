@@ -0,0 +1,59 @@
+'''
+Date formatting for templates.
+
+format_datetime backs the `datetime` Jinja filter. It formats datetime
+objects directly instead of round-tripping them through strings, compiles
+each Babel pattern once per locale and format, and keeps the most recently
+formatted values in a bounded LRU cache, since listing pages tend to
+repeat the same start times.
+'''
+import os
+from datetime import datetime
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+# Babel's own named formats are built from several locale patterns at
+# format time, so they are left to babel.dates.format_datetime
+BABEL_FORMATS = ('long', 'short')
+
+DATETIME_CACHE_SIZE = int(os.getenv('DATETIME_CACHE_SIZE', 4096))
+
+
+@lru_cache(maxsize=None)
+def get_locale(identifier):
+    '''Return the Babel Locale for identifier, loading its data only once.'''
+    return Locale.parse(identifier)
+
+
+@lru_cache(maxsize=256)
+def get_pattern(format, identifier):
+    '''Return the compiled Babel pattern of format for a locale.'''
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def _format_datetime(value, format, identifier):
+    if not isinstance(value, datetime):
+        # still accept the str(datetime) values templates used to receive
+        value = dateutil.parser.parse(value)
+    if format in BABEL_FORMATS:
+        return babel.dates.format_datetime(value, format, locale=identifier)
+    return get_pattern(format, identifier).apply(value, get_locale(identifier))
+
+
+def format_datetime(value, format='medium', locale=None):
+    '''
+    Format a datetime (or a string holding one) with a named format from
+    DATETIME_FORMATS, one of Babel's named formats, or a custom Babel
+    pattern. Naive datetimes are formatted as they are, without any time
+    zone conversion.
+    '''
+    return _format_datetime(value, format, locale or babel.dates.LC_TIME)
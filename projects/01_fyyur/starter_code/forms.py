@@ -1,25 +1,48 @@
 from datetime import datetime
 import re
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField, IntegerField
-from wtforms.validators import DataRequired, AnyOf, URL, Regexp, Optional, ValidationError
+from wtforms import StringField, SelectField, SelectMultipleField, DateField, DateTimeField, BooleanField, TextAreaField, IntegerField, HiddenField
+from wtforms.validators import DataRequired, AnyOf, URL, Regexp, Optional, ValidationError, NumberRange
+from models import MAX_SHOW_DURATION
+from bookings import MAX_OCCURRENCES
 
 def check_phone_number(form, field):
     if re.search(r'^(\(\d{3}\).?|\d{3}\-?)[\d]{3}[\-]?[\d]{4}$', field.data) is None:
         raise ValidationError("Invalid phone number.")
 
 class ShowForm(FlaskForm):
-    artist_id = StringField(
-        'artist_id', 
+    artist_id = IntegerField(
+        'artist_id', validators=[DataRequired()]
     )
-    venue_id = StringField(
-        'venue_id'
+    venue_id = IntegerField(
+        'venue_id', validators=[DataRequired()]
     )
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        # in minutes
+        'duration', validators=[Optional(), NumberRange(min=1, max=MAX_SHOW_DURATION)],
+        default=120
+    )
+    repeat = SelectField(
+        'repeat', validators=[Optional()],
+        choices=[
+            ('', 'Does not repeat'),
+            ('weekly', 'Weekly'),
+            ('biweekly', 'Every two weeks'),
+        ],
+        default=''
+    )
+    # a recurring show ends on this date or after this many shows
+    repeat_until = DateField(
+        'repeat_until', validators=[Optional()]
+    )
+    repeat_count = IntegerField(
+        'repeat_count', validators=[Optional(), NumberRange(min=1, max=MAX_OCCURRENCES)]
+    )
 
 class VenueForm(FlaskForm):
     name = StringField(
@@ -131,6 +154,12 @@ class VenueForm(FlaskForm):
         'seeking_description'
     )
 
+class EditVenueForm(VenueForm):
+    # the version of the venue the editor started from
+    version = HiddenField(
+        'version', validators=[DataRequired()]
+    )
+
 class ArtistForm(FlaskForm):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -240,4 +269,10 @@ class ArtistForm(FlaskForm):
         'seeking_description'
     )
 
+class EditArtistForm(ArtistForm):
+    # the version of the artist the editor started from
+    version = HiddenField(
+        'version', validators=[DataRequired()]
+    )
+
 # TODO IMPLEMENT NEW ARTIST FORM AND NEW SHOW FORM
@@ -0,0 +1,350 @@
+'''
+Bulk import of venues, artists and shows from CSV or NDJSON files.
+
+Every row is validated with the same form class the create pages use
+(VenueForm, ArtistForm or ShowForm), so the phone format, state and genre
+choices and URL checks stay in one place. Shows must also reference a
+venue and an artist that exist, and may not overlap a booking of either,
+whether already in the database or earlier in the file. The venues and
+artists a chunk of shows references are read with their bookings before
+it is validated, so only those are held in memory. Rows that fail are
+reported with their line number and skipped; the rest of the file is
+still imported.
+
+Valid rows are written in chunks of IMPORT_CHUNK_SIZE, each in its own
+transaction: with COPY on PostgreSQL and executemany elsewhere. Imported
+shows are added to the venue and artist show counters in the same
+transaction.
+
+In CSV files genres are given as one comma separated column, e.g.
+"Jazz,Blues". An optional id column keeps the ids of the source data.
+'''
+import csv
+import io
+import json
+from datetime import timedelta
+from itertools import islice
+
+from werkzeug.datastructures import MultiDict
+
+from bookings import IntervalIndex
+from counters import count_shows
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION
+
+FORMATS = ('csv', 'ndjson')
+
+# stands for the id of a show earlier in the file in the booking index
+PENDING_ID = 0
+
+
+class ImportResult:
+    '''Counts of the rows a run imported and rejected.'''
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+
+
+#----------------------------------------------------------------------------#
+# Reading.
+#----------------------------------------------------------------------------#
+
+def read_rows(f, format):
+    '''
+    Yield (line number, row) for every record of a CSV or NDJSON file.
+    row is None when the line can not be parsed.
+    '''
+    if format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'ndjson':
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError('Unknown import format: {}'.format(format))
+
+
+def _formdata(row):
+    # hand the row to the form the way a browser would post it
+    formdata = MultiDict()
+    for key, value in row.items():
+        if value is None or value is False:
+            continue
+        if key == 'genres':
+            if isinstance(value, str):
+                value = value.split(',')
+            for genre in value:
+                formdata.add(key, genre.strip())
+        else:
+            formdata.add(key, 'y' if value is True else str(value))
+    return formdata
+
+
+#----------------------------------------------------------------------------#
+# Validation.
+#----------------------------------------------------------------------------#
+
+class Loader:
+    '''Validates rows of one model and writes them to its table.'''
+
+    model = None
+    form_class = None
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._known_ids = None
+        # one form is reprocessed for every row, binding its fields is the
+        # expensive part of creating one
+        self.form = self.form_class(formdata=None, meta={'csrf': False})
+
+    def _ids(self, model):
+        with self.engine.connect() as connection:
+            return {id for id, in connection.execute(db.select([model.id]))}
+
+    @property
+    def known_ids(self):
+        # only read when rows come with their own ids
+        if self._known_ids is None:
+            self._known_ids = self._ids(self.model)
+        return self._known_ids
+
+    def prepare(self, rows):
+        '''Called with the rows of a chunk before they are cleaned.'''
+
+    def clean(self, row):
+        '''Return (values, errors) for a row; values is None if it is invalid.'''
+        form = self.form
+        form.process(_formdata(row))
+        form.validate()
+        errors = dict(form.errors)
+        values = self.values(form, errors)
+
+        if row.get('id') not in (None, ''):
+            try:
+                values['id'] = int(row['id'])
+            except (TypeError, ValueError):
+                errors['id'] = ['Not a valid integer value']
+            else:
+                if values['id'] in self.known_ids:
+                    errors['id'] = ['Already exists.']
+        if errors:
+            return None, errors
+        if 'id' in values:
+            # also catches an id repeated further down the file
+            self.known_ids.add(values['id'])
+        return values, None
+
+    def values(self, form, errors):
+        '''Turn a validated form into column values, adding to errors.'''
+        return dict(form.data)
+
+    def written(self, connection, rows):
+        '''Called in the chunk's transaction once rows are written.'''
+
+    def failed(self, rows):
+        '''Called with the values of a chunk whose transaction failed.'''
+
+
+class VenueLoader(Loader):
+    model = Venue
+    form_class = VenueForm
+
+    def values(self, form, errors):
+        values = dict(form.data)
+        # the same normalisation as create_venue_submission
+        values['city'] = values['city'].title()
+        values['address'] = values['address'].title()
+        return values
+
+
+class ArtistLoader(Loader):
+    model = Artist
+    form_class = ArtistForm
+
+    def values(self, form, errors):
+        values = dict(form.data)
+        values['city'] = values['city'].title()
+        return values
+
+
+class ShowLoader(Loader):
+    model = Show
+    form_class = ShowForm
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        # the venues and artists the file referenced so far, those of them
+        # that exist, and their bookings and those of the rows accepted
+        self.loaded = {'venue_id': set(), 'artist_id': set()}
+        self.existing = {'venue_id': set(), 'artist_id': set()}
+        self.bookings = IntervalIndex()
+
+    def prepare(self, rows):
+        # only what the chunk references is read, so memory grows with the
+        # file rather than with the tables
+        for field, model, kind in (('venue_id', Venue, 'venue'), ('artist_id', Artist, 'artist')):
+            ids = set()
+            for row in rows:
+                try:
+                    ids.add(int(row.get(field)))
+                except (TypeError, ValueError):
+                    pass
+            ids -= self.loaded[field]
+            if not ids:
+                continue
+            self.loaded[field] |= ids
+            column = getattr(Show, field)
+            with self.engine.connect() as connection:
+                self.existing[field].update(
+                    id for id, in connection.execute(db.select([model.id]).where(model.id.in_(ids))))
+                # through the (venue_id, start_time) and (artist_id, start_time) indexes
+                bookings = connection.execute(db.select([Show.id, column, Show.start_time, Show.duration]
+                  ).where(column.in_(ids)))
+                for id, key_id, start_time, duration in bookings:
+                    self.bookings.add((kind, key_id), start_time, start_time + timedelta(minutes=duration), id)
+
+    def values(self, form, errors):
+        values = {
+            'start_time': form.start_time.data,
+            'duration': form.duration.data or DEFAULT_SHOW_DURATION,
+        }
+        for field, existing in self.existing.items():
+            values[field] = form.data[field]
+            if field not in errors and values[field] not in existing:
+                errors[field] = ['Does not exist.']
+        if not errors:
+            conflict = self.bookings.find_show(values['venue_id'], values['artist_id'],
+                                               values['start_time'], values['duration'])
+            if conflict:
+                errors['start_time'] = ['The {} is already booked at that time.'.format(conflict[0])]
+            else:
+                self.bookings.add_show(PENDING_ID, values['venue_id'], values['artist_id'],
+                                       values['start_time'], values['duration'])
+        return values
+
+    def written(self, connection, rows):
+        count_shows(connection, rows)
+
+    def failed(self, rows):
+        # the rows were not written, so later ones may take their slots
+        for values in rows:
+            self.bookings.remove_show(values['venue_id'], values['artist_id'], values['start_time'])
+
+
+LOADERS = {
+    'venues': VenueLoader,
+    'artists': ArtistLoader,
+    'shows': ShowLoader,
+}
+
+
+#----------------------------------------------------------------------------#
+# Writing.
+#----------------------------------------------------------------------------#
+
+def _pg_array(values):
+    return '{' + ','.join('"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+                          for value in values) + '}'
+
+
+def _copy_rows(connection, table, columns, rows):
+    buffer = io.StringIO()
+    # quoting every string keeps '' apart from NULL, which COPY reads from
+    # an empty unquoted field
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows:
+        writer.writerow([_pg_array(row[column]) if isinstance(row[column], list) else row[column]
+                         for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        table.name, ', '.join('"{}"'.format(column) for column in columns)), buffer)
+
+
+def write_rows(connection, table, rows):
+    '''Insert rows, dicts sharing the same keys, into table.'''
+    if connection.dialect.driver == 'psycopg2':
+        _copy_rows(connection, table, list(rows[0]), rows)
+    else:
+        connection.execute(table.insert(), rows)
+
+
+def _reset_id_sequence(connection, table):
+    # rows imported with their own ids leave the sequence behind
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence(:table, 'id'), max(id)) FROM \"{}\"".format(table.name)
+          ), table='"{}"'.format(table.name))
+
+
+#----------------------------------------------------------------------------#
+# Import.
+#----------------------------------------------------------------------------#
+
+def import_rows(kind, rows, chunk_size=10000, on_error=None):
+    '''
+    Import (line number, row) pairs as venues, artists or shows. Invalid
+    rows and failed chunks are passed to on_error(line numbers, errors)
+    and skipped. Returns an ImportResult.
+    '''
+    engine = db.engine
+    table = LOADERS[kind].model.__table__
+    loader = LOADERS[kind](engine)
+    result = ImportResult()
+    rows = iter(rows)
+    with_ids = False
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        loader.prepare([row for _, row in chunk if row is not None])
+        valid = []
+        for line_number, row in chunk:
+            values, errors = loader.clean(row) if row is not None else (None, {'row': ['Not a valid record.']})
+            if errors:
+                result.rejected += 1
+                if on_error:
+                    on_error([line_number], errors)
+                continue
+            valid.append((line_number, values))
+        if not valid:
+            continue
+
+        # COPY needs the same columns on every row
+        groups = ([values for _, values in valid if 'id' in values],
+                  [values for _, values in valid if 'id' not in values])
+        try:
+            with engine.begin() as connection:
+                for group in groups:
+                    if group:
+                        write_rows(connection, table, group)
+                        loader.written(connection, group)
+        except Exception as error:
+            loader.failed([values for _, values in valid])
+            result.rejected += len(valid)
+            if on_error:
+                on_error([line_number for line_number, _ in valid], {'chunk': [str(error).strip()]})
+            continue
+        result.imported += len(valid)
+        with_ids = with_ids or bool(groups[0])
+
+    if with_ids:
+        with engine.begin() as connection:
+            _reset_id_sequence(connection, table)
+    return result
+
+
+def import_file(kind, path, format=None, chunk_size=10000, on_error=None):
+    '''Import a CSV or NDJSON file, choosing the format from its extension by default.'''
+    format = format or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        return import_rows(kind, read_rows(f, format), chunk_size, on_error)
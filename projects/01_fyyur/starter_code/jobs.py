@@ -0,0 +1,280 @@
+'''
+Background jobs for the side effects of writes.
+
+Handlers commit, enqueue the follow-up work, such as publishing new shows
+to the live feed of every worker, and respond without waiting for it.
+Jobs are rows of a SQLite database at JOBS_DB, so they survive a restart
+and are shared by every worker of the host. A job is
+enqueued after the write it follows has committed; if the process dies in
+between, that job is lost, never run for a write that rolled back.
+
+A dispatcher thread in each worker claims due jobs and runs them on a pool
+of JOBS_WORKERS threads, inside an app context. Claiming a job leases it
+for JOBS_LEASE seconds; a job whose worker died runs again once its lease
+runs out. A job that raises is retried after JOBS_BACKOFF seconds,
+doubling with every attempt, until it has run JOBS_MAX_ATTEMPTS times;
+then it is marked failed. Finished jobs are deleted after JOBS_RETENTION
+seconds. /internal/jobs reports the queue.
+
+With JOBS_WORKERS=0 no threads are started, and `flask run-jobs` runs the
+due jobs instead.
+'''
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_at ON jobs (status, run_at);
+'''
+
+# the longest wait between two attempts, in seconds
+MAX_BACKOFF = 3600
+
+# seconds between two purges of finished jobs
+PURGE_INTERVAL = 60
+
+
+def backoff(attempts, base):
+    '''Seconds to wait before the next attempt of a job that failed attempts times.'''
+    delay = min(MAX_BACKOFF, base * 2 ** (attempts - 1))
+    # spread out the retries of jobs that failed together
+    return delay * random.uniform(0.5, 1.5)
+
+
+class JobQueue:
+    '''Jobs stored in a SQLite database, safe to share between processes.'''
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self.connect()
+        # readers do not block the writer
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+
+    def connect(self):
+        '''Return this thread's connection, in autocommit mode.'''
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # with WAL, commits survive the process crashing without waiting for fsync
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def put(self, name, args, now=None):
+        now = now or time.time()
+        cursor = self.connect().execute(
+            "INSERT INTO jobs (name, args, status, run_at, created_at) VALUES (?, ?, 'queued', ?, ?)",
+            (name, json.dumps(args), now, now))
+        return cursor.lastrowid
+
+    def claim(self, max_attempts, now=None):
+        '''
+        Lease the job that is due first and return its (id, name, args,
+        attempts), or None if no job is due. Running jobs whose lease ran
+        out are due again, or failed if they have no attempts left.
+        '''
+        now = now or time.time()
+        connection = self.connect()
+        # take the write lock first, so no two workers claim the same job
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            while True:
+                row = connection.execute(
+                    "SELECT id, name, args, status, attempts FROM jobs"
+                    " WHERE status IN ('queued', 'running') AND run_at <= ?"
+                    " ORDER BY run_at, id LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    return None
+                id, name, args, status, attempts = row
+                if status == 'running' and attempts >= max_attempts:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, last_error = ? WHERE id = ?",
+                        (now, 'Lease expired', id))
+                    continue
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, run_at = ? WHERE id = ?",
+                    (now + self.lease, id))
+                return id, name, json.loads(args), attempts + 1
+        finally:
+            connection.execute('COMMIT')
+
+    def finish(self, id, now=None):
+        self.connect().execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, last_error = NULL WHERE id = ?",
+            (now or time.time(), id))
+
+    def retry(self, id, run_at, error):
+        self.connect().execute(
+            "UPDATE jobs SET status = 'queued', run_at = ?, last_error = ? WHERE id = ?",
+            (run_at, error, id))
+
+    def fail(self, id, error, now=None):
+        self.connect().execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, last_error = ? WHERE id = ?",
+            (now or time.time(), error, id))
+
+    def purge(self, before):
+        '''Delete the jobs that finished before the time before.'''
+        self.connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (before,))
+
+    def status(self, failures=10):
+        '''Return the number of jobs per status, the age of the oldest due job and the last failures.'''
+        connection = self.connect()
+        counts = dict(connection.execute('SELECT status, count(*) FROM jobs GROUP BY status'))
+        oldest = connection.execute(
+            "SELECT min(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?",
+            (time.time(),)).fetchone()[0]
+        failed = connection.execute(
+            "SELECT id, name, attempts, finished_at, last_error FROM jobs WHERE status = 'failed'"
+            " ORDER BY finished_at DESC LIMIT ?", (failures,))
+        return {
+            'counts': {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')},
+            'oldest_due_seconds': round(time.time() - oldest, 3) if oldest is not None else None,
+            'failed': [{
+                'id': id,
+                'name': name,
+                'attempts': attempts,
+                'finished_at': finished_at,
+                'error': error
+            } for id, name, attempts, finished_at, error in failed]
+        }
+
+
+class Jobs:
+    '''Runs the registered tasks enqueued by request handlers.'''
+
+    def __init__(self, app=None):
+        self.tasks = {}
+        self.queue = None
+        self.pid = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('JOBS_WORKERS', 2)
+        self.max_attempts = app.config.get('JOBS_MAX_ATTEMPTS', 5)
+        self.backoff = app.config.get('JOBS_BACKOFF', 5)
+        self.poll_interval = app.config.get('JOBS_POLL_INTERVAL', 1)
+        self.retention = app.config.get('JOBS_RETENTION', 24 * 3600)
+        self.queue = JobQueue(app.config['JOBS_DB'], app.config.get('JOBS_LEASE', 300))
+        self.busy = 0
+        self.wakeup = threading.Event()
+        app.before_first_request(self.start)
+
+    def task(self, function):
+        '''Register function as a task that can be enqueued.'''
+        self.tasks[function.__name__] = function
+        return function
+
+    def enqueue(self, task, *args):
+        '''Queue a call of task with args, which must be JSON serializable.'''
+        if task.__name__ not in self.tasks:
+            raise ValueError('Not a registered task: {}'.format(task.__name__))
+        id = self.queue.put(task.__name__, args)
+        self.start()
+        self.wakeup.set()
+        return id
+
+    def start(self):
+        '''Start this worker's dispatcher and thread pool, unless it already has.'''
+        with self.lock:
+            # workers forked after the app was loaded need threads of their own
+            if self.workers <= 0 or self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+            self.slots = threading.Semaphore(self.workers)
+            threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True).start()
+
+    def _dispatch(self):
+        purged = 0
+        while True:
+            self.slots.acquire()
+            try:
+                if time.time() - purged > PURGE_INTERVAL:
+                    self.queue.purge(time.time() - self.retention)
+                    purged = time.time()
+                self.wakeup.clear()
+                job = self.queue.claim(self.max_attempts)
+            except Exception:
+                logger.exception('Could not claim a job')
+                job = None
+            if job is None:
+                self.slots.release()
+                self.wakeup.wait(self.poll_interval)
+                continue
+            self.executor.submit(self._run_in_slot, job)
+
+    def _run_in_slot(self, job):
+        with self.lock:
+            self.busy += 1
+        try:
+            self.run(job)
+        finally:
+            with self.lock:
+                self.busy -= 1
+            self.slots.release()
+
+    def run(self, job, now=None):
+        '''Run a claimed job, then mark it done, due for a retry or failed.'''
+        id, name, args, attempts = job
+        task = self.tasks.get(name)
+        try:
+            if task is None:
+                raise LookupError('Unknown task {}'.format(name))
+            with self.app.app_context():
+                task(*args)
+        except Exception:
+            error = traceback.format_exc()
+            if task is None or attempts >= self.max_attempts:
+                logger.exception('Job %s (%s) failed after %s attempts', id, name, attempts)
+                self.queue.fail(id, error, now)
+            else:
+                logger.warning('Job %s (%s) failed, attempt %s of %s', id, name, attempts, self.max_attempts)
+                self.queue.retry(id, (now or time.time()) + backoff(attempts, self.backoff), error)
+        else:
+            self.queue.finish(id, now)
+
+    def run_pending(self, now=None):
+        '''Run the due jobs one after the other in this thread and return how many ran.'''
+        count = 0
+        while True:
+            job = self.queue.claim(self.max_attempts, now)
+            if job is None:
+                return count
+            self.run(job, now)
+            count += 1
+
+    def status(self):
+        '''Report the queue and this worker's threads.'''
+        status = self.queue.status()
+        status.update(workers=self.workers if self.pid == os.getpid() else 0, busy=self.busy)
+        return status
@@ -0,0 +1,243 @@
+'''
+Live feed of newly listed shows over Server-Sent Events.
+
+create_show_submission publishes every show it lists once it has
+committed. Each worker runs a Broker that fans those events out to the
+clients connected to it, each with a queue of at most LIVE_QUEUE_SIZE
+events. A client that falls that far behind is disconnected instead of
+buffered without limit; its EventSource reconnects with the id of the
+last show it received in Last-Event-ID, and the shows listed since are
+replayed from the database.
+
+Buses carry published events to the broker of every worker:
+  memory  straight to this worker's broker, for a single worker
+  socket  Unix datagram sockets in LIVE_BUS_DIR, one per worker of the
+          host; a local stand-in for a message broker such as Redis
+          pub/sub
+'''
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import tempfile
+import threading
+import uuid
+from collections import namedtuple
+
+from flask import json as flask_json
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', 'id name data')
+
+# milliseconds an EventSource waits before reconnecting
+RETRY_MS = 3000
+
+# the largest datagram a SocketBus receives
+MAX_MESSAGE_BYTES = 65536
+
+
+def format_event(event):
+    '''Return event as a Server-Sent Events message.'''
+    lines = ['id: {}'.format(event.id), 'event: {}'.format(event.name)]
+    lines.extend('data: ' + line for line in event.data.split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    '''The bounded queue of events waiting to be sent to one client.'''
+
+    def __init__(self, maxsize):
+        self.events = queue.Queue(maxsize)
+        # set by the broker when the queue overflowed
+        self.dropped = False
+
+    def get(self, timeout):
+        '''Return the next event, or None if none came within timeout seconds.'''
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+    '''Fans the events published in this worker out to its subscribers.'''
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event):
+        '''Queue event for every subscriber, dropping those whose queue is full.'''
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                # a client this far behind catches up from the database
+                # when it reconnects
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+
+#----------------------------------------------------------------------------#
+# Buses.
+#----------------------------------------------------------------------------#
+
+class MemoryBus:
+    '''Delivers events to this worker's broker only.'''
+
+    # whether events published in one process reach the others
+    shared = False
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def start(self):
+        pass
+
+    def publish(self, event):
+        self.broker.publish(event)
+
+
+class SocketBus:
+    '''
+    Delivers events to every worker of the host through Unix datagram
+    sockets in directory, one per worker, this one included. A listener
+    thread hands the events that arrive to the broker. The sockets of
+    workers that have exited are removed by the next publish.
+    '''
+
+    shared = True
+
+    def __init__(self, broker, directory):
+        self.broker = broker
+        self.directory = directory
+        self.pid = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        '''Open this worker's socket, unless it already has.'''
+        # workers forked after the app was loaded need sockets of their own
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.path = os.path.join(self.directory, '{}.sock'.format(uuid.uuid4().hex))
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.bind(self.path)
+            atexit.register(self.close)
+            threading.Thread(target=self._listen, args=(self.socket,),
+                             name='live-bus', daemon=True).start()
+
+    def _listen(self, receiver):
+        while True:
+            try:
+                message = receiver.recv(MAX_MESSAGE_BYTES)
+            except OSError:
+                # closed
+                return
+            self.broker.publish(Event(*json.loads(message.decode('utf-8'))))
+
+    def publish(self, event):
+        self.start()
+        message = json.dumps(list(event)).encode('utf-8')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith('.sock'):
+                    continue
+                try:
+                    sender.sendto(message, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                except OSError as error:
+                    # the worker is not keeping up; its clients miss the event
+                    logger.warning('Could not deliver live event %s to %s: %s', event.id, name, error)
+
+    def close(self):
+        if self.pid == os.getpid():
+            self.socket.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def make_bus(config, broker):
+    '''Create the bus named by the LIVE_BUS setting.'''
+    kind = config.get('LIVE_BUS', 'memory')
+    if kind == 'memory':
+        return MemoryBus(broker)
+    if kind == 'socket':
+        return SocketBus(broker, config.get('LIVE_BUS_DIR') or os.path.join(tempfile.gettempdir(), 'fyyur-live'))
+    raise ValueError('Unknown LIVE_BUS backend: {}'.format(kind))
+
+
+#----------------------------------------------------------------------------#
+# Flask integration.
+#----------------------------------------------------------------------------#
+
+class LiveFeed:
+    '''Publishes events and streams them to Server-Sent Events clients.'''
+
+    def __init__(self, app=None):
+        self.broker = Broker()
+        self.bus = MemoryBus(self.broker)
+        self.keepalive = 15
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.broker = Broker(app.config.get('LIVE_QUEUE_SIZE', 100))
+        self.bus = make_bus(app.config, self.broker)
+        self.keepalive = app.config.get('LIVE_KEEPALIVE', 15)
+
+    def publish(self, id, name, data):
+        '''Send data, encoded as JSON, to the subscribers of every worker.'''
+        self.bus.publish(Event(id, name, flask_json.dumps(data)))
+
+    def stream(self, replay=()):
+        '''
+        Yield the messages of one client: the (id, name, data) events in
+        replay first, then the ones published from the moment the stream
+        starts, with a comment every LIVE_KEEPALIVE seconds without any so
+        proxies keep the connection open. Ends when the client falls
+        LIVE_QUEUE_SIZE events behind.
+        '''
+        self.bus.start()
+        # subscribe before replaying, so nothing published in between is missed
+        subscription = self.broker.subscribe()
+        try:
+            yield 'retry: {}\n\n'.format(RETRY_MS)
+            replayed = set()
+            for id, name, data in replay:
+                replayed.add(id)
+                yield format_event(Event(id, name, flask_json.dumps(data)))
+            while not subscription.dropped:
+                event = subscription.get(self.keepalive)
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif event.id not in replayed:
+                    yield format_event(event)
+        finally:
+            self.broker.unsubscribe(subscription)
@@ -0,0 +1,144 @@
+'''
+Non-blocking, rotating application log.
+
+Log calls on request threads only put the record on a queue; a
+QueueListener thread writes it to LOG_FILE, rotating the file by size
+(LOG_MAX_BYTES) or by time (LOG_ROTATE_WHEN) and keeping LOG_BACKUP_COUNT
+old files. Every module logger propagates to the root logger, so they all
+go through the same queue.
+
+With LOG_REQUESTS on, every request is logged once it has finished, with
+its route, method, path, status and duration as structured fields. Set
+LOG_FORMAT=json to write one JSON object per line, including those fields.
+'''
+import atexit
+import json
+import logging
+import queue
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from flask import g, request
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+# fields added to the log records of requests
+REQUEST_FIELDS = ('route', 'method', 'path', 'status', 'duration_ms')
+
+logger = logging.getLogger(__name__)
+
+
+class JSONFormatter(logging.Formatter):
+    '''Formats records as one JSON object per line.'''
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in REQUEST_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RequestQueueHandler(QueueHandler):
+    '''
+    A QueueHandler that leaves formatting to the listener. The stock one
+    formats the whole line on the caller's thread, which the listener's
+    formatter would then format again; this one only merges the message
+    arguments and renders the traceback, which can not cross threads.
+    '''
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def make_file_handler(config):
+    '''Create the rotating file handler described by the LOG_* settings.'''
+    if config['LOG_ROTATE'] == 'time':
+        handler = TimedRotatingFileHandler(config['LOG_FILE'], when=config['LOG_ROTATE_WHEN'],
+                                           backupCount=config['LOG_BACKUP_COUNT'], delay=True)
+    elif config['LOG_ROTATE'] == 'size':
+        handler = RotatingFileHandler(config['LOG_FILE'], maxBytes=config['LOG_MAX_BYTES'],
+                                      backupCount=config['LOG_BACKUP_COUNT'], delay=True)
+    else:
+        raise ValueError('Unknown LOG_ROTATE mode: {}'.format(config['LOG_ROTATE']))
+    if config['LOG_FORMAT'] == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def setup_logging(app):
+    '''
+    Send the log of app and every other module through a queue to a
+    rotating file. Returns the started QueueListener.
+    '''
+    level = logging.getLevelName(app.config['LOG_LEVEL'])
+    records = queue.Queue(-1)
+    handler = RequestQueueHandler(records)
+    handler.setLevel(level)
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    app.logger.setLevel(level)
+
+    listener = QueueListener(records, make_file_handler(app.config), respect_handler_level=True)
+    listener.queue_handler = handler
+    listener.start()
+    # flush what is still queued when the worker exits
+    atexit.register(listener.stop)
+
+    if app.config['LOG_REQUESTS']:
+        app.before_request(_start_timer)
+        app.after_request(_record_status)
+        # runs after streamed responses have been sent
+        app.teardown_request(_log_request)
+    return listener
+
+
+def stop_logging(listener):
+    '''Flush the queue, stop the listener and detach its queue handler.'''
+    atexit.unregister(listener.stop)
+    listener.stop()
+    logging.getLogger().removeHandler(listener.queue_handler)
+
+
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+def _record_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+def _log_request(exc):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    status = 500 if exc is not None else g.pop('response_status', None)
+    fields = {
+        'route': request.endpoint,
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+    }
+    logger.info('%(method)s %(path)s %(status)s %(duration_ms).1fms', fields, extra=fields)
+
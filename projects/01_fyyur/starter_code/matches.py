@@ -0,0 +1,102 @@
+'''
+Matchmaking between artists and venues.
+
+For an artist, ranks the venues seeking talent; for a venue, the artists
+seeking a venue. Candidates score points for every genre they share with
+the subject, for being in the same city or state, and for the shows the
+two have already played together.
+
+Only rows that share a genre or a city with the subject, or have played
+with it before, are read. They are found through the GIN index on genres
+and the (state, city) indexes.
+'''
+from collections import namedtuple
+from datetime import datetime
+
+from models import db, Venue, Artist, Show
+
+GENRE_POINTS = 3
+CITY_POINTS = 2
+STATE_POINTS = 1
+PAST_SHOW_POINTS = 1
+# past shows beyond this many add no more points
+MAX_PAST_SHOWS = 5
+
+Candidate = namedtuple('Candidate', 'id name city state genres')
+
+
+def seeking_column(model):
+    '''The flag a venue or artist sets when it is looking for the other.'''
+    return Venue.seeking_talent if model is Venue else Artist.seeking_venue
+
+
+#----------------------------------------------------------------------------#
+# Matching.
+#----------------------------------------------------------------------------#
+
+def _past_shows(subject_fk, candidate_fk, subject_id):
+    '''Map each candidate the subject has played with to their number of past shows.'''
+    rows = db.session.query(candidate_fk, db.func.count()).filter(
+        subject_fk==subject_id, Show.start_time < datetime.now()
+      ).group_by(candidate_fk)
+    return dict(rows.all())
+
+
+def _candidates(model, subject, past_ids):
+    sources = []
+    if subject.genres:
+        sources.append(db.select([model.id]).where(
+            model.genres.overlap(db.cast(subject.genres, model.genres.type))))
+    if subject.city and subject.state:
+        sources.append(db.select([model.id]).where(
+            db.and_(model.state==subject.state, model.city==subject.city)))
+    if past_ids:
+        sources.append(db.select([model.id]).where(model.id.in_(past_ids)))
+    if not sources:
+        return []
+    ids = db.union(*sources).alias()
+    rows = db.session.query(model.id, model.name, model.city, model.state, model.genres
+      ).join(ids, ids.c.id==model.id).filter(seeking_column(model).is_(True))
+    return [Candidate(*row) for row in rows]
+
+
+def score(subject, candidate, past_shows):
+    '''Return the points of candidate for subject and the genres they share.'''
+    shared = set(subject.genres or ()) & set(candidate.genres or ())
+    points = GENRE_POINTS * len(shared) + PAST_SHOW_POINTS * min(past_shows, MAX_PAST_SHOWS)
+    if subject.state and candidate.state == subject.state:
+        points += STATE_POINTS
+        if subject.city and candidate.city == subject.city:
+            points += CITY_POINTS
+    return points, sorted(shared)
+
+
+def find_matches(subject, limit=None):
+    '''
+    Rank the venues for an artist, or the artists for a venue, best match
+    first. Each match is a dict with its id, name, city, state, the
+    genres it shares with subject, its number of past shows with subject
+    and its score.
+    '''
+    if isinstance(subject, Artist):
+        model, subject_fk, candidate_fk = Venue, Show.artist_id, Show.venue_id
+    else:
+        model, subject_fk, candidate_fk = Artist, Show.venue_id, Show.artist_id
+    past = _past_shows(subject_fk, candidate_fk, subject.id)
+
+    candidates = _candidates(model, subject, list(past))
+
+    matches = []
+    for candidate in candidates:
+        points, shared = score(subject, candidate, past.get(candidate.id, 0))
+        matches.append({
+            "id": candidate.id,
+            "name": candidate.name,
+            "city": candidate.city,
+            "state": candidate.state,
+            "shared_genres": shared,
+            "past_shows": past.get(candidate.id, 0),
+            "score": points
+        })
+    matches.sort(key=lambda match: (-match["score"], match["id"]))
+    return matches[:limit]
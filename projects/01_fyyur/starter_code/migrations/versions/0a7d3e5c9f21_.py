@@ -0,0 +1,26 @@
+"""version columns on venues and artists for optimistic concurrency
+
+Revision ID: 0a7d3e5c9f21
+Revises: f3c0d8a45b17
+Create Date: 2026-10-18 13:22:47.381950
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a7d3e5c9f21'
+down_revision = 'f3c0d8a45b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Artist', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Artist', 'version')
+    op.drop_column('Venue', 'version')
@@ -0,0 +1,66 @@
+"""data version for the JSON API's ETags
+
+Revision ID: 5e2b7d9c4a18
+Revises: 0a7d3e5c9f21
+Create Date: 2026-10-18 15:42:37.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b7d9c4a18'
+down_revision = '0a7d3e5c9f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('DataVersion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO "DataVersion" (id, version) VALUES (1, 0)')
+    op.create_table('DataChange',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('''
+        CREATE OR REPLACE FUNCTION note_data_change() RETURNS trigger AS $$
+        BEGIN
+          IF current_setting('fyyur.data_changed', true) IS DISTINCT FROM 'on' THEN
+            PERFORM set_config('fyyur.data_changed', 'on', true);
+            INSERT INTO "DataChange" DEFAULT VALUES;
+          END IF;
+          RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+          UPDATE "DataVersion" SET version = version + 1 WHERE id = 1;
+          DELETE FROM "DataChange" WHERE id = NEW.id;
+          RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    for table in ('Venue', 'Artist', 'Show'):
+        op.execute('''
+            CREATE TRIGGER "{0}_data_change" AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{0}"
+              FOR EACH STATEMENT EXECUTE PROCEDURE note_data_change()
+        '''.format(table))
+    op.execute('''
+        CREATE CONSTRAINT TRIGGER "DataChange_bump" AFTER INSERT ON "DataChange"
+          DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE bump_data_version()
+    ''')
+
+
+def downgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        op.execute('DROP TRIGGER "{0}_data_change" ON "{0}"'.format(table))
+    op.drop_table('DataChange')
+    op.drop_table('DataVersion')
+    op.execute('DROP FUNCTION note_data_change(), bump_data_version()')
@@ -0,0 +1,46 @@
+"""store genres as native arrays with GIN indexes
+
+Revision ID: 8b5d41e6c2fa
+Revises: 3f2a9c1b7e54
+Create Date: 2026-10-18 10:03:17.214590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5d41e6c2fa'
+down_revision = '3f2a9c1b7e54'
+branch_labels = None
+depends_on = None
+
+# genres were written as array literals such as '{Jazz,"Rock n Roll"}' into a
+# VARCHAR column; anything else is treated as a comma separated list
+TO_ARRAY = '''
+    CASE
+      WHEN genres IS NULL OR genres = '' THEN NULL
+      WHEN left(genres, 1) = '{' THEN genres::varchar(120)[]
+      ELSE string_to_array(genres, ',')::varchar(120)[]
+    END
+'''
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.alter_column(table, 'genres',
+                   existing_type=sa.String(length=120),
+                   type_=postgresql.ARRAY(sa.String(length=120)),
+                   postgresql_using=TO_ARRAY)
+        op.create_index('ix_{}_genres'.format(table), table, ['genres'], unique=False,
+                        postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_index('ix_{}_genres'.format(table), table_name=table)
+        op.alter_column(table, 'genres',
+                   existing_type=postgresql.ARRAY(sa.String(length=120)),
+                   type_=sa.String(length=120),
+                   postgresql_using='genres::varchar(120)')
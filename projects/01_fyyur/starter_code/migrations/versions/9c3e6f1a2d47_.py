@@ -0,0 +1,23 @@
+"""index artists by city for matchmaking
+
+Revision ID: 9c3e6f1a2d47
+Revises: 5e2b7d9c4a18
+Create Date: 2026-10-18 17:05:12.663841
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e6f1a2d47'
+down_revision = '5e2b7d9c4a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Artist_state_city', 'Artist', ['state', 'city'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Artist_state_city', table_name='Artist')
@@ -0,0 +1,28 @@
+"""track when the shows of venues and artists last changed
+
+Revision ID: b6f0a4e8d213
+Revises: 9c3e6f1a2d47
+Create Date: 2026-10-18 18:31:54.107395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f0a4e8d213'
+down_revision = '9c3e6f1a2d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('shows_changed_at', sa.DateTime(), nullable=True))
+        # existing feeds start out as changed now
+        op.execute('UPDATE "{}" SET shows_changed_at = LOCALTIMESTAMP WHERE past_shows_count + upcoming_shows_count > 0'.format(table))
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        op.drop_column(table, 'shows_changed_at')
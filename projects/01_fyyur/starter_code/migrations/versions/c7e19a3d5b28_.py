@@ -0,0 +1,23 @@
+"""index shows on (start_time, id) for keyset pagination
+
+Revision ID: c7e19a3d5b28
+Revises: 8b5d41e6c2fa
+Create Date: 2026-10-18 10:41:55.630482
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e19a3d5b28'
+down_revision = '8b5d41e6c2fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
@@ -0,0 +1,42 @@
+"""maintained upcoming and past show counters
+
+Revision ID: d4a8f2c61e93
+Revises: c7e19a3d5b28
+Create Date: 2026-10-18 11:26:08.918342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8f2c61e93'
+down_revision = 'c7e19a3d5b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, show_fk in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.execute('''
+            UPDATE "{table}" SET
+              upcoming_shows_count = (SELECT count(*) FROM "Show"
+                WHERE "Show".{show_fk} = "{table}".id AND "Show".start_time >= LOCALTIMESTAMP),
+              past_shows_count = (SELECT count(*) FROM "Show"
+                WHERE "Show".{show_fk} = "{table}".id AND "Show".start_time < LOCALTIMESTAMP)
+        '''.format(table=table, show_fk=show_fk))
+    op.create_table('ShowCounterState',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO "ShowCounterState" (id, rolled_until) VALUES (1, LOCALTIMESTAMP)')
+
+
+def downgrade():
+    op.drop_table('ShowCounterState')
+    for table in ('Venue', 'Artist'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
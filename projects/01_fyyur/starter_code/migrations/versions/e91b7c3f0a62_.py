@@ -0,0 +1,27 @@
+"""composite indexes for the venue, artist and area queries
+
+Revision ID: e91b7c3f0a62
+Revises: d4a8f2c61e93
+Create Date: 2026-10-18 12:08:41.215730
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e91b7c3f0a62'
+down_revision = 'd4a8f2c61e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_Venue_state_city_id', 'Venue', ['state', 'city', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_state_city_id', table_name='Venue')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
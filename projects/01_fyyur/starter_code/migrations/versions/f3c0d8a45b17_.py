@@ -0,0 +1,34 @@
+"""show durations and double-booking exclusion constraints
+
+Revision ID: f3c0d8a45b17
+Revises: e91b7c3f0a62
+Create Date: 2026-10-18 12:41:19.664027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c0d8a45b17'
+down_revision = 'e91b7c3f0a62'
+branch_labels = None
+depends_on = None
+
+SHOW_TIME_RANGE = "tsrange(start_time, start_time + duration * interval '1 minute')"
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('duration', sa.Integer(), server_default='120', nullable=False))
+    # fails, naming the shows involved, if existing bookings already overlap
+    for name, column in (('ex_Show_venue_booking', 'venue_id'), ('ex_Show_artist_booking', 'artist_id')):
+        op.execute('''
+            ALTER TABLE "Show" ADD CONSTRAINT "{name}" EXCLUDE USING gist
+              (int4range({column}, {column}, '[]') WITH &&, {time_range} WITH &&)
+        '''.format(name=name, column=column, time_range=SHOW_TIME_RANGE))
+
+
+def downgrade():
+    op.drop_constraint('ex_Show_artist_booking', 'Show')
+    op.drop_constraint('ex_Show_venue_booking', 'Show')
+    op.drop_column('Show', 'duration')
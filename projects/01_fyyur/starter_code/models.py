@@ -1,7 +1,13 @@
+from datetime import datetime, timedelta
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_moment import Moment
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import ARRAY, ExcludeConstraint
+
+from dbpool import TimedQueuePool
 
 # #----------------------------------------------------------------------------#
 # # App Config.
@@ -9,9 +15,14 @@ from flask_moment import Moment
 
 db = SQLAlchemy()
 
+# name search relies on pg_trgm's trigram operators and GIN operator class
+event.listen(db.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
 def setup_db(app):
     moment = Moment(app)
     app.config.from_object('config')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('poolclass', TimedQueuePool)
     db = SQLAlchemy(app)
     migrate = Migrate(app, db)
 
@@ -23,6 +34,13 @@ def setup_db(app):
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_name_trgm', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        # /venues groups by area, ordered by (state, city, id)
+        db.Index('ix_Venue_state_city_id', 'state', 'city', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -30,40 +48,169 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String(120)))
+    genres = db.Column(ARRAY(db.String(120)))
     image_link = db.Column(db.String(500))
     website = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(200))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # when a show was last added or removed, or the details it shows edited,
+    # the Last-Modified of the calendar feed
+    shows_changed_at = db.Column(db.DateTime)
+    # bumped by every ORM update, which only applies if the row still has
+    # the version it was loaded with
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     shows = db.relationship('Show', backref='venue', lazy=True)
+    __mapper_args__ = {'version_id_col': version}
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_name_trgm', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+        # matchmaking looks up the artists of a city
+        db.Index('ix_Artist_state_city', 'state', 'city'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String(120)))
+    genres = db.Column(ARRAY(db.String(120)))
     image_link = db.Column(db.String(500))
     website = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(200))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # when a show was last added or removed, or the details it shows edited,
+    # the Last-Modified of the calendar feed
+    shows_changed_at = db.Column(db.DateTime)
+    # bumped by every ORM update, which only applies if the row still has
+    # the version it was loaded with
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     shows = db.relationship('Show', backref='artist', lazy=True)
+    __mapper_args__ = {'version_id_col': version}
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+# a show books its venue and its artist for [start_time, start_time + duration)
+SHOW_TIME_RANGE = "tsrange(start_time, start_time + duration * interval '1 minute')"
+
+def id_range(column):
+  '''A one-id range, so ids can join a GiST exclusion without btree_gist.'''
+  return "int4range({0}, {0}, '[]')".format(column)
+
+DEFAULT_SHOW_DURATION = 120
+# the longest duration ShowForm accepts
+MAX_SHOW_DURATION = 24 * 60
+
 class Show(db.Model):
   __tablename__ = "Show"
+  __table_args__ = (
+    # keyset pagination of /shows walks (start_time, id)
+    db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+    # the venue and artist pages load their shows in start_time order
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    # no two shows overlap at the same venue or for the same artist
+    ExcludeConstraint((db.text(id_range('venue_id')), '&&'), (db.text(SHOW_TIME_RANGE), '&&'),
+                      name='ex_Show_venue_booking', using='gist'),
+    ExcludeConstraint((db.text(id_range('artist_id')), '&&'), (db.text(SHOW_TIME_RANGE), '&&'),
+                      name='ex_Show_artist_booking', using='gist'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   venue_id = db.Column(db.Integer, db.ForeignKey("Venue.id"), nullable=False)
   artist_id = db.Column(db.Integer, db.ForeignKey("Artist.id"), nullable=False)
-  start_time = db.Column(db.DateTime, nullable=False)
\ No newline at end of file
+  start_time = db.Column(db.DateTime, nullable=False)
+  # in minutes
+  duration = db.Column(db.Integer, nullable=False, default=DEFAULT_SHOW_DURATION,
+                       server_default=str(DEFAULT_SHOW_DURATION))
+
+  @property
+  def end_time(self):
+    return self.start_time + timedelta(minutes=self.duration)
+
+class ShowCounterState(db.Model):
+  '''
+  Single row holding the watermark of the show counters: shows starting
+  at or after rolled_until are counted as upcoming. See counters.py.
+  '''
+  __tablename__ = "ShowCounterState"
+
+  id = db.Column(db.Integer, primary_key=True)
+  rolled_until = db.Column(db.DateTime, nullable=False)
+
+@event.listens_for(ShowCounterState.__table__, 'after_create')
+def insert_show_counter_state(target, connection, **kw):
+  connection.execute(target.insert().values(id=1, rolled_until=datetime.now()))
+
+class DataVersion(db.Model):
+  '''
+  Single row holding a version of the data in Venue, Artist and Show,
+  bumped by the database whenever a transaction that wrote to them
+  commits. The JSON API derives its ETags from it, see etags.py.
+  '''
+  __tablename__ = "DataVersion"
+
+  id = db.Column(db.Integer, primary_key=True)
+  version = db.Column(db.BigInteger, nullable=False)
+
+@event.listens_for(DataVersion.__table__, 'after_create')
+def insert_data_version(target, connection, **kw):
+  connection.execute(target.insert().values(id=1, version=0))
+
+# one row per writing transaction, removed again when it bumps DataVersion
+DataChange = db.Table('DataChange', db.metadata,
+  db.Column('id', db.Integer, primary_key=True))
+
+# Every statement that writes to a versioned table notes the change, once
+# per transaction, by inserting into DataChange. The row's deferred trigger
+# then bumps DataVersion at commit, so the version row is the last lock a
+# writer takes and no two writers can deadlock over it.
+DATA_VERSION_FUNCTIONS = '''
+CREATE OR REPLACE FUNCTION note_data_change() RETURNS trigger AS $$
+BEGIN
+  IF current_setting('fyyur.data_changed', true) IS DISTINCT FROM 'on' THEN
+    PERFORM set_config('fyyur.data_changed', 'on', true);
+    INSERT INTO "DataChange" DEFAULT VALUES;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE "DataVersion" SET version = version + 1 WHERE id = 1;
+  DELETE FROM "DataChange" WHERE id = NEW.id;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+DATA_CHANGE_TRIGGER = '''
+CREATE TRIGGER "{0}_data_change" AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{0}"
+  FOR EACH STATEMENT EXECUTE PROCEDURE note_data_change()
+'''
+DATA_VERSION_TRIGGER = '''
+CREATE CONSTRAINT TRIGGER "DataChange_bump" AFTER INSERT ON "DataChange"
+  DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE bump_data_version()
+'''
+
+event.listen(db.metadata, 'before_create',
+    DDL(DATA_VERSION_FUNCTIONS).execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'after_drop',
+    DDL('DROP FUNCTION IF EXISTS note_data_change(), bump_data_version()').execute_if(dialect='postgresql'))
+for model in (Venue, Artist, Show):
+  event.listen(model.__table__, 'after_create',
+      DDL(DATA_CHANGE_TRIGGER.format(model.__tablename__)).execute_if(dialect='postgresql'))
+event.listen(DataChange, 'after_create', DDL(DATA_VERSION_TRIGGER).execute_if(dialect='postgresql'))
@@ -0,0 +1,151 @@
+'''
+Per-request SQL statistics.
+
+Engine events time every statement a request runs. When the request ends,
+its query count, total database time and slowest statement are added to
+histograms kept per route, which /internal/queries reports. A request that
+runs the same statement more than QUERY_REPEAT_THRESHOLD times, the
+signature of a lazy load inside a loop, is logged as a likely N+1.
+
+The cost per statement is two event callbacks and a dict update, so it is
+meant to stay on in production; set QUERY_STATS=false to turn it off.
+'''
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets; the last bucket is unbounded
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    '''Counts of observed values per bucket, with their sum.'''
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
+        self.sum += value
+
+    def to_dict(self):
+        labels = ['<={}'.format(bound) for bound in self.bounds] + ['>{}'.format(self.bounds[-1])]
+        return {'buckets': dict(zip(labels, self.counts)), 'sum': round(self.sum, 3)}
+
+
+class RouteStats:
+    '''Query statistics of every request to one route.'''
+
+    def __init__(self):
+        self.requests = 0
+        self.query_counts = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_time_ms = Histogram(DB_TIME_BUCKETS_MS)
+        self.slowest = (0.0, None)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'queries': self.query_counts.to_dict(),
+            'db_time_ms': self.db_time_ms.to_dict(),
+            'slowest_statement': {
+                'duration_ms': round(self.slowest[0], 3),
+                'statement': self.slowest[1],
+            },
+        }
+
+
+class RequestQueries:
+    '''The statements run by the current request.'''
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = (0.0, None)
+        self.statements = Counter()
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] += 1
+        if duration > self.slowest[0]:
+            self.slowest = (duration, statement)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'request_queries' in g:
+        context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'query_start', None)
+    if start is not None and has_request_context() and 'request_queries' in g:
+        g.request_queries.add(statement, time.perf_counter() - start)
+
+
+class QueryStats:
+    '''Collects the SQL statistics of every request, per route.'''
+
+    def __init__(self, app=None):
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.repeat_threshold = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('QUERY_STATS', True):
+            return
+        self.repeat_threshold = app.config.get('QUERY_REPEAT_THRESHOLD', 10)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self._start_request)
+        # streamed responses keep the request context until the body is sent,
+        # so their queries are included
+        app.teardown_request(self._end_request)
+
+    def _start_request(self):
+        g.request_queries = RequestQueries()
+
+    def _end_request(self, exc):
+        queries = g.pop('request_queries', None)
+        if queries is None or request.endpoint is None:
+            return
+        self.record(request.endpoint, queries)
+
+        statement, repeats = max(queries.statements.items(), key=lambda item: item[1],
+                                 default=(None, 0))
+        if repeats > self.repeat_threshold:
+            logger.warning('Likely N+1 query in %s: the same statement ran %d times: %s',
+                           request.endpoint, repeats, ' '.join(statement.split()))
+
+    def record(self, endpoint, queries):
+        '''Add the statistics of one request to its route.'''
+        with self.lock:
+            stats = self.routes.get(endpoint)
+            if stats is None:
+                stats = self.routes[endpoint] = RouteStats()
+            stats.requests += 1
+            stats.query_counts.observe(queries.count)
+            stats.db_time_ms.observe(queries.total_time * 1000)
+            if queries.slowest[0] * 1000 > stats.slowest[0]:
+                stats.slowest = (queries.slowest[0] * 1000, queries.slowest[1])
+
+    def to_dict(self):
+        with self.lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in sorted(self.routes.items())}
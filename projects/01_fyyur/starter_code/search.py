@@ -0,0 +1,47 @@
+'''
+Name search for venues and artists.
+
+The search runs against the trigram GIN indexes created by
+the pg_trgm migration: a name matches when it contains the search term
+(ILIKE) or is a close fuzzy match of it (the word similarity operator),
+and results are ranked by word similarity.
+'''
+from models import db
+
+def search_with_upcoming_shows(model, search_term, limit=None, offset=0):
+    '''
+    Search venues or artists by name, best match first.
+
+    Each match comes back with its maintained number of upcoming shows,
+    and "count" is the total number of matches regardless of limit and
+    offset.
+    '''
+    rank = db.func.word_similarity(search_term, model.name)
+    # custom operators are emitted verbatim, so double the percent sign for
+    # drivers that use it as their parameter marker
+    paramstyle = db.session.get_bind().dialect.paramstyle
+    word_similar = '<%%' if paramstyle in ('format', 'pyformat') else '<%'
+    matches = db.or_(
+        model.name.ilike('%' + search_term + '%'),
+        db.literal(search_term).op(word_similar)(model.name))
+    rows = db.session.query(
+        model.id, model.name,
+        model.upcoming_shows_count.label('num_upcoming_shows'),
+        db.func.count().over().label('total')
+      ).filter(matches).order_by(rank.desc(), model.id
+      ).offset(offset).limit(limit).all()
+    if rows:
+        total = rows[0].total
+    elif offset or limit == 0:
+        # an empty page, or one past the last match, has no row to carry the total
+        total = db.session.query(db.func.count(model.id)).filter(matches).scalar()
+    else:
+        total = 0
+    return {
+        "count": total,
+        "data": [{
+            "id": row.id,
+            "name": row.name,
+            "num_upcoming_shows": row.num_upcoming_shows
+        } for row in rows]
+    }
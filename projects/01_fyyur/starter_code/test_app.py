@@ -0,0 +1,960 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+# point the app at the test database before config.py is loaded
+os.environ['DB_NAME'] = os.getenv('TEST_DB_NAME', 'fyyur_test')
+# the tests write straight to the database, so responses are not cached
+os.environ['RESPONSE_CACHE'] = 'null'
+# background jobs are run by the tests themselves, from a queue of their own
+os.environ['JOBS_WORKERS'] = '0'
+os.environ['JOBS_DB'] = os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3')
+
+from flask import Flask, url_for
+from sqlalchemy import create_engine, event, exc
+
+from app import app, paginate_shows, response_cache, query_stats, live_feed, jobs, publish_listed_shows, \
+    without_statement_timeout
+from cache import FileSystemCache, MemoryCache, NullCache
+from counters import roll_over_shows, recount_shows
+from importer import import_rows
+from logs import setup_logging, stop_logging
+from assets import Assets, build_assets
+from bookings import IntervalIndex, find_conflicts
+from calendars import fold
+from dbpool import TimedQueuePool, pool_status
+from live import Broker, Event, SocketBus
+from matches import find_matches
+from models import db, Venue, Artist, Show, ShowCounterState
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client = self.app.test_client
+        self.show_batches = 0
+
+        # binds the app to the current context
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            venue = Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                          address='1015 Folsom Street', phone='123-123-1234', genres=['Jazz'])
+            artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                            phone='326-123-5000', genres=['Rock n Roll'])
+            db.session.add_all([venue, artist])
+            db.session.commit()
+            self.venue_id = venue.id
+            self.artist_id = artist.id
+        # drop the jobs left by earlier tests
+        jobs.queue.connect().execute('DELETE FROM jobs')
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def add_shows(self, count):
+        """Add count shows between the test venue and artist, half of them upcoming"""
+        now = datetime.now()
+        # later batches start two hours later each, so no bookings overlap
+        hours = 1 + 2 * self.show_batches
+        self.show_batches += 1
+        with self.app.app_context():
+            db.session.add_all([Show(
+                venue_id=self.venue_id,
+                artist_id=self.artist_id,
+                start_time=now + timedelta(days=day - count // 2, hours=hours),
+                duration=60
+            ) for day in range(count)])
+            db.session.commit()
+
+    def count_queries(self, url, method='get', **kwargs):
+        """Return the response to a request of url and the number of queries it ran"""
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = getattr(self.client(), method)(url, **kwargs)
+            # streamed pages only run their queries while the body is read
+            res.get_data()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return res, len(statements)
+
+    # Test venue and artist detail pages
+
+    def test_show_venue_query_count_is_constant(self):
+        self.add_shows(2)
+        res, few_shows_queries = self.count_queries('/venues/{}'.format(self.venue_id))
+        self.assertEqual(res.status_code, 200)
+
+        self.add_shows(40)
+        res, many_shows_queries = self.count_queries('/venues/{}'.format(self.venue_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(few_shows_queries, 1)
+        self.assertEqual(many_shows_queries, few_shows_queries)
+
+    def test_show_artist_query_count_is_constant(self):
+        self.add_shows(2)
+        res, few_shows_queries = self.count_queries('/artists/{}'.format(self.artist_id))
+        self.assertEqual(res.status_code, 200)
+
+        self.add_shows(40)
+        res, many_shows_queries = self.count_queries('/artists/{}'.format(self.artist_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(few_shows_queries, 1)
+        self.assertEqual(many_shows_queries, few_shows_queries)
+
+    def test_show_venue_splits_past_and_upcoming_shows(self):
+        self.add_shows(4)
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+        data = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('2 Upcoming Shows', data)
+        self.assertIn('2 Past Shows', data)
+
+    def test_detail_pages_split_shows_at_the_roll_over(self):
+        with self.app.app_context():
+            ShowCounterState.query.update({'rolled_until': datetime.now() - timedelta(hours=1)})
+            db.session.add(Show(venue_id=self.venue_id, artist_id=self.artist_id,
+                                start_time=datetime.now() - timedelta(minutes=10)))
+            db.session.commit()
+        url = '/api/venues/{}'.format(self.venue_id)
+
+        # started, but counted as upcoming until the next roll-over
+        data = json.loads(self.client().get(url).data)
+        self.assertEqual((data['upcoming_shows_count'], data['past_shows_count']), (1, 0))
+
+        with self.app.app_context():
+            roll_over_shows()
+        data = json.loads(self.client().get(url).data)
+        self.assertEqual((data['upcoming_shows_count'], data['past_shows_count']), (0, 1))
+
+    def test_404_show_venue_not_found(self):
+        res = self.client().get('/venues/100000')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_404_show_artist_not_found(self):
+        res = self.client().get('/artists/100000')
+
+        self.assertEqual(res.status_code, 404)
+
+    # Test genre filters
+
+    def test_filter_venues_by_genre(self):
+        res = self.client().get('/venues?genre=Jazz')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('The Musical Hop', res.data.decode())
+
+        res = self.client().get('/venues?genre=Punk')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('The Musical Hop', res.data.decode())
+
+    def test_filter_artists_by_genre(self):
+        res = self.client().get('/artists?genre=Rock n Roll')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Guns N Petals', res.data.decode())
+
+        res = self.client().get('/artists?genre=Jazz')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Guns N Petals', res.data.decode())
+
+    # Test shows listing
+
+    def test_paginate_shows_with_cursors(self):
+        self.add_shows(5)
+        with self.app.test_request_context():
+            first, prev_cursor, next_cursor = paginate_shows(per_page=2)
+            self.assertEqual(len(first), 2)
+            self.assertIsNone(prev_cursor)
+
+            second, prev_cursor, next_cursor = paginate_shows(after=next_cursor, per_page=2)
+            self.assertEqual(len(second), 2)
+            self.assertTrue(first[-1].start_time < second[0].start_time)
+
+            last, _, no_next_cursor = paginate_shows(after=next_cursor, per_page=2)
+            self.assertEqual(len(last), 1)
+            self.assertIsNone(no_next_cursor)
+
+            back, _, _ = paginate_shows(before=prev_cursor, per_page=2)
+            self.assertEqual([show.id for show in back], [show.id for show in first])
+
+    def test_get_shows_page_query_count_is_constant(self):
+        self.add_shows(5)
+        res, queries = self.count_queries('/shows')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(queries, 1)
+
+    # Test show counters
+
+    def test_show_counters_follow_inserts_and_deletes(self):
+        self.add_shows(4)
+        with self.app.app_context():
+            venue = Venue.query.get(self.venue_id)
+            self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (2, 2))
+
+            db.session.delete(Show.query.filter(Show.start_time>=datetime.now()).first())
+            db.session.commit()
+            artist = Artist.query.get(self.artist_id)
+            self.assertEqual((artist.upcoming_shows_count, artist.past_shows_count), (1, 2))
+
+    def test_roll_over_shows_moves_started_shows(self):
+        self.add_shows(4)
+        with self.app.app_context():
+            moved = roll_over_shows(datetime.now() + timedelta(hours=2))
+            self.assertEqual(moved, 1)
+            venue = Venue.query.get(self.venue_id)
+            self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (1, 3))
+
+            recount_shows()
+            venue = Venue.query.get(self.venue_id)
+            self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (2, 2))
+
+    # Test double bookings
+
+    def test_create_show_rejects_double_booking(self):
+        show = {'artist_id': self.artist_id, 'venue_id': self.venue_id,
+                'start_time': '2030-05-21 21:30:00', 'duration': '120'}
+        self.client().post('/shows/create', data=show)
+        res = self.client().post('/shows/create', data=dict(show, start_time='2030-05-21 23:00:00'))
+
+        self.assertIn('the venue is already booked', res.data.decode())
+        with self.app.app_context():
+            self.assertEqual(Show.query.count(), 1)
+
+        # back-to-back shows do not overlap
+        res = self.client().post('/shows/create', data=dict(show, start_time='2030-05-21 23:30:00'))
+        self.assertIn('successfully listed', res.data.decode())
+        with self.app.app_context():
+            self.assertEqual(find_conflicts(self.venue_id, 100000, [datetime(2030, 5, 21, 22)], 60),
+                             [(datetime(2030, 5, 21, 22), 'venue', 1)])
+            self.assertEqual(find_conflicts(100000, self.artist_id, [datetime(2030, 5, 22, 1)], 60)[0][1],
+                             'artist')
+
+    def test_create_weekly_show_inserts_every_occurrence(self):
+        show = {'artist_id': self.artist_id, 'venue_id': self.venue_id,
+                'start_time': '2030-05-21 21:30:00', 'duration': '120',
+                'repeat': 'weekly', 'repeat_until': '2030-07-30'}
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().post('/shows/create', data=show)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertIn('11 shows were successfully listed', res.data.decode())
+        self.assertEqual(len([s for s in statements if s.startswith('INSERT INTO "Show"')]), 1)
+        with self.app.app_context():
+            self.assertEqual(Show.query.count(), 11)
+            venue = Venue.query.get(self.venue_id)
+            self.assertEqual(venue.upcoming_shows_count, 11)
+
+        # one clash rejects the whole residency
+        res = self.client().post('/shows/create', data=dict(
+            show, start_time='2030-04-30 22:00:00', repeat='biweekly', repeat_until='', repeat_count='6'))
+        self.assertIn('already booked for 4 of the 6 dates, the first on 2030-05-28', res.data.decode())
+        with self.app.app_context():
+            self.assertEqual(Show.query.count(), 11)
+
+    def test_create_show_validates_the_form(self):
+        show = {'artist_id': self.artist_id, 'venue_id': self.venue_id,
+                'start_time': '2030-05-21 21:30:00', 'duration': '120'}
+        for invalid in ({'duration': '-5'}, {'duration': '1441'}, {'start_time': 'tomorrow'},
+                        {'repeat': 'weekly', 'repeat_count': '0'}):
+            res = self.client().post('/shows/create', data=dict(show, **invalid))
+            self.assertIn('class="errors"', res.data.decode(), invalid)
+
+        # a recurrence that ends before its first show lists nothing
+        res = self.client().post('/shows/create', data=dict(show, repeat='weekly', repeat_until='2030-05-01'))
+        self.assertIn('can not end before its first show', res.data.decode())
+        with self.app.app_context():
+            self.assertEqual(Show.query.count(), 0)
+
+    def test_interval_index_finds_overlaps(self):
+        index = IntervalIndex()
+        start = datetime(2030, 1, 1, 20)
+        for day in range(100):
+            index.add_show(day, 1, day, start + timedelta(days=day), 120)
+
+        self.assertEqual(index.find_show(1, 999, start + timedelta(days=50, hours=1), 30), ('venue', 50))
+        self.assertEqual(index.find_show(2, 50, start + timedelta(days=50, minutes=-30), 60), ('artist', 50))
+        self.assertIsNone(index.find_show(1, 999, start + timedelta(days=50, hours=2), 60))
+
+    # Test matchmaking
+
+    def test_artist_matches_rank_venues(self):
+        self.add_shows(4)
+        with self.app.app_context():
+            Venue.query.get(self.venue_id).seeking_talent = True
+            db.session.add_all([
+                Venue(name='Rock Hall', city='New York', state='NY', genres=['Rock n Roll'],
+                      seeking_talent=True),
+                Venue(name='Corner Club', city='San Francisco', state='CA', genres=['Folk'],
+                      seeking_talent=True),
+                Venue(name='Far Away', city='New York', state='NY', genres=['Folk'],
+                      seeking_talent=True),
+                Venue(name='Closed Doors', city='San Francisco', state='CA', genres=['Rock n Roll'],
+                      seeking_talent=False),
+            ])
+            db.session.commit()
+
+            matches = find_matches(Artist.query.get(self.artist_id))
+            self.assertEqual([(match['name'], match['score']) for match in matches],
+                             [('The Musical Hop', 5), ('Rock Hall', 3), ('Corner Club', 3)])
+            self.assertEqual(matches[0]['past_shows'], 2)
+            self.assertEqual(matches[1]['shared_genres'], ['Rock n Roll'])
+
+        res = self.client().get('/artists/{}/matches'.format(self.artist_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Rock Hall', res.data.decode())
+
+    # Test search
+
+    def require_pg_trgm(self):
+        with self.app.app_context():
+            installed = db.session.execute(
+                "SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'").scalar()
+        if not installed:
+            self.skipTest('pg_trgm is not installed')
+
+    def add_venues(self, names):
+        with self.app.app_context():
+            db.session.add_all([Venue(name=name, city='San Francisco', state='CA', address='',
+                                      phone='', genres=['Jazz']) for name in names])
+            db.session.commit()
+
+    def search_venues(self, search_term, **window):
+        """Return the names of the venues found for search_term and the count shown"""
+        res = self.client().post('/venues/search', data=dict(search_term=search_term, **window))
+        body = res.data.decode()
+        count = int(re.search(r'Number of search results for "[^"]*": (\d+)', body).group(1))
+        return re.findall(r'<h5>(.*?)</h5>', body), count
+
+    def test_search_query_count_is_constant(self):
+        self.require_pg_trgm()
+        self.add_venues(['Hall {:02}'.format(i) for i in range(2)])
+        res, few_queries = self.count_queries('/venues/search', 'post', data={'search_term': 'Hall'})
+        self.assertIn('Hall 01', res.data.decode())
+
+        self.add_venues(['Hall {:02}'.format(i) for i in range(2, 30)])
+        res, many_queries = self.count_queries('/venues/search', 'post', data={'search_term': 'Hall'})
+        self.assertIn('Hall 29', res.data.decode())
+        self.assertEqual(few_queries, many_queries)
+
+    def test_search_pages_through_results(self):
+        self.require_pg_trgm()
+        names = ['Hall {:02}'.format(i) for i in range(12)]
+        self.add_venues(names)
+
+        pages = []
+        for offset in (0, 5, 10):
+            found, count = self.search_venues('hall', limit=5, offset=offset)
+            self.assertEqual(count, 12)
+            pages.append(found)
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), names)
+
+        self.assertEqual(self.search_venues('hall', offset=20), ([], 12))
+
+    def test_search_limit_is_capped(self):
+        self.require_pg_trgm()
+        self.add_venues(['Hall {:02}'.format(i) for i in range(4)])
+        self.app.config['SEARCH_RESULTS_LIMIT'] = 3
+        try:
+            self.assertEqual(self.search_venues('Hall', limit=50), (['Hall 00', 'Hall 01', 'Hall 02'], 4))
+            self.assertEqual(self.search_venues('Hall'), (['Hall 00', 'Hall 01', 'Hall 02'], 4))
+        finally:
+            self.app.config['SEARCH_RESULTS_LIMIT'] = 100
+
+    def test_search_ranks_closer_matches_first(self):
+        self.require_pg_trgm()
+        # added after The Musical Hop, so only the ranking can put it first
+        self.add_venues(['Musicale Club'])
+        self.assertEqual(self.search_venues('Musicale'), (['Musicale Club', 'The Musical Hop'], 2))
+
+    # Test calendars
+
+    def test_venue_calendar_lists_its_shows(self):
+        self.add_shows(2)
+        res = self.client().get('/venues/{}/calendar.ics'.format(self.venue_id))
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/calendar')
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('SUMMARY:Guns N Petals at The Musical Hop\r\n', body)
+        self.assertIn('LOCATION:The Musical Hop\\, 1015 Folsom Street\\, San Francisco\\, CA\r\n', body)
+
+    def test_calendar_answers_if_modified_since_with_304(self):
+        self.add_shows(1)
+        url = '/artists/{}/calendar.ics'.format(self.artist_id)
+        # a change less than a second old is sent without a date
+        self.assertNotIn('Last-Modified', self.client().get(url).headers)
+        with self.app.app_context():
+            Artist.query.filter_by(id=self.artist_id).update(
+                {'shows_changed_at': datetime.now() - timedelta(minutes=1)})
+            db.session.commit()
+
+        res = self.client().get(url)
+        modified = res.headers['Last-Modified']
+        self.assertEqual(res.status_code, 200)
+        res, queries = self.count_queries(url, headers={'If-Modified-Since': modified})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(queries, 1)
+
+        self.add_shows(1)
+        res = self.client().get(url, headers={'If-Modified-Since': modified})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data.decode().count('BEGIN:VEVENT'), 2)
+
+    def test_editing_a_venue_modifies_the_calendars_listing_it(self):
+        self.add_shows(1)
+        url = '/artists/{}/calendar.ics'.format(self.artist_id)
+        with self.app.app_context():
+            Artist.query.filter_by(id=self.artist_id).update(
+                {'shows_changed_at': datetime.now() - timedelta(minutes=1)})
+            db.session.commit()
+        modified = self.client().get(url).headers['Last-Modified']
+
+        self.edit_venue(1, phone='415-000-1234')
+        res = self.client().get(url, headers={'If-Modified-Since': modified})
+        self.assertEqual(res.status_code, 304)
+
+        self.edit_venue(2, address='1 Market Street')
+        res = self.client().get(url, headers={'If-Modified-Since': modified})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('1 Market Street', res.data.decode())
+
+    def test_calendar_folds_long_lines(self):
+        line = 'SUMMARY:' + 'é' * 50
+        folded = fold(line)
+        self.assertTrue(all(len(part.encode('utf-8')) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', ''), line + '\r\n')
+
+    # Test live feed
+
+    def test_create_show_publishes_to_live_feed(self):
+        subscription = live_feed.broker.subscribe()
+        try:
+            self.client().post('/shows/create', data={
+                'artist_id': self.artist_id, 'venue_id': self.venue_id,
+                'start_time': '2030-05-21 21:30:00', 'repeat': 'weekly', 'repeat_count': '2'})
+            # the memory bus only reaches this worker, so it publishes right away
+            events = [subscription.get(0), subscription.get(0)]
+        finally:
+            live_feed.broker.unsubscribe(subscription)
+
+        self.assertEqual([event.name for event in events], ['show', 'show'])
+        data = json.loads(events[0].data)
+        self.assertEqual(data['artist_name'], 'Guns N Petals')
+        self.assertEqual(data['start_time'], '2030-05-21T21:30:00')
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_publishing_from_a_job_needs_a_shared_bus(self):
+        self.add_shows(1)
+        with self.app.app_context():
+            show = Show.query.one()
+            jobs.enqueue(publish_listed_shows, self.venue_id, [show.start_time.isoformat()])
+        with self.assertLogs('jobs', 'WARNING'):
+            jobs.run_pending()
+
+        queued = jobs.queue.connect().execute('SELECT last_error FROM jobs').fetchone()[0]
+        self.assertIn('needs LIVE_BUS=socket', queued)
+
+    def test_live_feed_replays_missed_shows(self):
+        self.add_shows(3)
+        with self.app.app_context():
+            ids = [show.id for show in Show.query.order_by(Show.id)]
+        res = self.client().get('/shows/live', headers={'Last-Event-ID': str(ids[0])}, buffered=False)
+        chunks = iter(res.response)
+        try:
+            self.assertEqual(res.mimetype, 'text/event-stream')
+            self.assertTrue(next(chunks).startswith(b'retry:'))
+            replayed = [next(chunks).decode(), next(chunks).decode()]
+        finally:
+            res.close()
+
+        self.assertTrue(replayed[0].startswith('id: {}\nevent: show\ndata: '.format(ids[1])))
+        self.assertTrue(replayed[1].startswith('id: {}\n'.format(ids[2])))
+
+    def test_live_feed_ignores_a_zero_last_event_id(self):
+        self.add_shows(2)
+        keepalive, live_feed.keepalive = live_feed.keepalive, 0
+        try:
+            res = self.client().get('/shows/live', headers={'Last-Event-ID': '0'}, buffered=False)
+            chunks = iter(res.response)
+            try:
+                self.assertTrue(next(chunks).startswith(b'retry:'))
+                # nothing is replayed, so the stream goes straight to waiting
+                self.assertEqual(next(chunks), b': keepalive\n\n')
+            finally:
+                res.close()
+        finally:
+            live_feed.keepalive = keepalive
+
+    def test_broker_drops_subscribers_that_fall_behind(self):
+        broker = Broker(queue_size=2)
+        slow, fast = broker.subscribe(), broker.subscribe()
+        for id in range(3):
+            broker.publish(Event(id, 'show', '{}'))
+            fast.get(0)
+
+        self.assertTrue(slow.dropped)
+        self.assertFalse(fast.dropped)
+        self.assertEqual(broker.subscribers, {fast})
+
+    def test_socket_bus_reaches_every_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            brokers = [Broker(), Broker()]
+            buses = [SocketBus(broker, directory) for broker in brokers]
+            subscriptions = [broker.subscribe() for broker in brokers]
+            try:
+                for bus in buses:
+                    bus.start()
+                buses[0].publish(Event(7, 'show', '{}'))
+                self.assertEqual([subscription.get(5) for subscription in subscriptions],
+                                 [Event(7, 'show', '{}')] * 2)
+            finally:
+                for bus in buses:
+                    bus.close()
+
+    # Test bulk import
+
+    def test_import_shows_reports_bad_rows(self):
+        errors = []
+        rows = [
+            (1, {'venue_id': self.venue_id, 'artist_id': self.artist_id, 'start_time': '2030-01-01 20:00:00'}),
+            (2, {'venue_id': self.venue_id, 'artist_id': 100000, 'start_time': '2030-01-01 20:00:00'}),
+            (3, {'venue_id': self.venue_id, 'artist_id': self.artist_id, 'start_time': 'tomorrow'}),
+            (4, None),
+            (5, {'venue_id': self.venue_id, 'artist_id': self.artist_id, 'start_time': '2019-01-01 20:00:00'}),
+        ]
+        with self.app.app_context():
+            result = import_rows('shows', rows, chunk_size=2,
+                                 on_error=lambda lines, row_errors: errors.append(lines))
+            venue = Venue.query.get(self.venue_id)
+
+            self.assertEqual((result.imported, result.rejected), (2, 3))
+            self.assertEqual(errors, [[2], [3], [4]])
+            self.assertEqual(Show.query.count(), 2)
+            self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (1, 1))
+
+    def test_failed_import_chunk_frees_its_bookings(self):
+        errors = []
+        show = {'venue_id': self.venue_id, 'artist_id': self.artist_id, 'start_time': '2030-01-01 20:00:00'}
+        rows = [
+            (1, show),
+            # an id out of range for the column fails the whole first chunk
+            (2, dict(show, start_time='2030-01-01 23:00:00', id=2 ** 40)),
+            (3, show),
+            (4, dict(show, start_time='2030-01-01 21:00:00')),
+        ]
+        with self.app.app_context():
+            result = import_rows('shows', rows, chunk_size=2,
+                                 on_error=lambda lines, row_errors: errors.append((lines, list(row_errors))))
+
+            self.assertEqual((result.imported, result.rejected), (1, 3))
+            self.assertEqual(errors, [([1, 2], ['chunk']), ([4], ['start_time'])])
+            self.assertEqual(Show.query.count(), 1)
+
+    def test_import_venues_validates_like_the_form(self):
+        rows = [
+            (2, {'name': 'Imported Hall', 'city': 'new york', 'state': 'NY', 'address': '1 main st',
+                 'phone': '123-123-1234', 'genres': 'Jazz,Blues'}),
+            (3, {'name': 'Bad Hall', 'city': 'new york', 'state': 'ZZ', 'address': '1 main st',
+                 'phone': '12', 'genres': 'Jazz'}),
+        ]
+        with self.app.app_context():
+            result = import_rows('venues', rows)
+            venue = Venue.query.filter_by(name='Imported Hall').one()
+
+            self.assertEqual((result.imported, result.rejected), (1, 1))
+            self.assertEqual(venue.city, 'New York')
+            self.assertEqual(venue.genres, ['Jazz', 'Blues'])
+
+    # Test internal endpoints
+
+    def test_get_pool_status(self):
+        self.client().get('/venues').get_data()
+        res = self.client().get('/internal/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['pool'], 'TimedQueuePool')
+        self.assertTrue(data['checkouts'])
+        self.assertIn('overflow', data)
+
+    def test_pool_counts_checkouts_that_time_out(self):
+        with self.app.app_context():
+            engine = create_engine(db.engine.url, poolclass=TimedQueuePool,
+                                   pool_size=1, max_overflow=0, pool_timeout=0.1)
+        try:
+            with engine.connect():
+                with self.assertLogs('dbpool', 'WARNING'), self.assertRaises(exc.TimeoutError):
+                    engine.connect()
+            status = pool_status(engine.pool)
+        finally:
+            engine.dispose()
+
+        self.assertEqual((status['checkouts'], status['timeouts']), (2, 1))
+        self.assertGreaterEqual(status['max_wait_ms'], 100)
+
+    def test_404_pool_status_outside_internal_hosts(self):
+        res = self.client().get('/internal/pool', environ_base={'REMOTE_ADDR': '203.0.113.7'})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_query_stats_per_route(self):
+        self.add_shows(3)
+        # streamed pages are recorded once their body has been sent
+        self.client().get('/venues').get_data()
+        self.client().get('/shows').get_data()
+        res = self.client().get('/internal/queries')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['venues']['requests'])
+        self.assertTrue(data['shows']['queries']['buckets']['<=1'])
+        self.assertIn('SELECT', data['shows']['slowest_statement']['statement'])
+
+    def test_repeated_statement_is_logged_as_n_plus_one(self):
+        with self.app.test_request_context('/shows'):
+            query_stats._start_request()
+            # a lazy load per row, the way show.venue.name inside a loop would
+            for _ in range(query_stats.repeat_threshold + 1):
+                Venue.query.filter_by(id=self.venue_id).first()
+            with self.assertLogs('querystats', 'WARNING') as logs:
+                query_stats._end_request(None)
+
+        self.assertIn('Likely N+1 query in shows', logs.output[0])
+
+    def test_failed_job_is_retried_with_backoff(self):
+        calls = []
+
+        @jobs.task
+        def flaky_job(value):
+            calls.append(value)
+            if len(calls) == 1:
+                raise RuntimeError('first attempt fails')
+
+        jobs.enqueue(flaky_job, 'x')
+        now = time.time()
+        with self.assertLogs('jobs', 'WARNING') as logs:
+            self.assertEqual(jobs.run_pending(now), 1)
+        self.assertIn('failed, attempt 1 of', logs.output[0])
+        # not due again before the backoff
+        self.assertEqual(jobs.run_pending(now + 1), 0)
+        self.assertEqual(jobs.run_pending(now + 2 * app.config['JOBS_BACKOFF']), 1)
+        self.assertEqual(calls, ['x', 'x'])
+
+        res = self.client().get('/internal/jobs')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['counts']['queued'], 0)
+        self.assertTrue(data['counts']['done'])
+
+    def test_job_fails_after_max_attempts(self):
+        @jobs.task
+        def broken_job():
+            raise RuntimeError('always fails')
+
+        id = jobs.enqueue(broken_job)
+        now = time.time()
+        with self.assertLogs('jobs', 'WARNING') as logs:
+            for attempt in range(app.config['JOBS_MAX_ATTEMPTS']):
+                # later than any backoff
+                jobs.run_pending(now + attempt * 7200)
+        self.assertIn('failed after', logs.output[-1])
+
+        failed = jobs.status()['failed'][0]
+        self.assertEqual((failed['id'], failed['attempts']), (id, app.config['JOBS_MAX_ATTEMPTS']))
+        self.assertIn('always fails', failed['error'])
+
+    # Test logging
+
+    def test_requests_are_logged_with_structured_fields(self):
+        log_app = Flask(__name__)
+        log_app.add_url_rule('/ping', 'ping', lambda: 'pong')
+        with tempfile.TemporaryDirectory() as directory:
+            log_app.config.update(
+                LOG_FILE=os.path.join(directory, 'app.log'), LOG_LEVEL='INFO', LOG_FORMAT='json',
+                LOG_ROTATE='size', LOG_MAX_BYTES=1024, LOG_BACKUP_COUNT=2, LOG_REQUESTS=True)
+            listener = setup_logging(log_app)
+            try:
+                for _ in range(20):
+                    log_app.test_client().get('/ping')
+            finally:
+                stop_logging(listener)
+            with open(log_app.config['LOG_FILE']) as f:
+                entry = json.loads(f.readline())
+            rotated = sorted(os.listdir(directory))
+
+        self.assertEqual(entry['route'], 'ping')
+        self.assertEqual(entry['status'], 200)
+        self.assertIn('duration_ms', entry)
+        self.assertEqual(rotated, ['app.log', 'app.log.1', 'app.log.2'])
+
+    # Test deletes
+
+    def test_delete_venue_deletes_its_shows_in_bulk(self):
+        self.add_shows(40)
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().delete('/venues/{}'.format(self.venue_id))
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(json.loads(res.data)['success'])
+        self.assertEqual(len([s for s in statements if s.startswith('DELETE')]), 2)
+        self.assertLess(len(statements), 10)
+        with self.app.app_context():
+            self.assertIsNone(Venue.query.get(self.venue_id))
+            self.assertEqual(Show.query.count(), 0)
+            artist = Artist.query.get(self.artist_id)
+            self.assertEqual((artist.upcoming_shows_count, artist.past_shows_count), (0, 0))
+
+    def test_404_delete_artist_not_found(self):
+        res = self.client().delete('/artists/100000')
+
+        self.assertEqual(res.status_code, 404)
+
+    # Test edits
+
+    def edit_venue(self, version, **changes):
+        """POST an edit of the test venue and return the response and the UPDATEs it ran"""
+        data = dict({
+            'name': 'The Musical Hop',
+            'city': 'San Francisco',
+            'state': 'CA',
+            'address': '1015 Folsom Street',
+            'phone': '123-123-1234',
+            'genres': ['Jazz'],
+            'image_link': '',
+            'website': '',
+            'facebook_link': '',
+            'seeking_description': '',
+            'version': str(version),
+        }, **changes)
+        updates = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE'):
+                updates.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().post('/venues/{}/edit'.format(self.venue_id), data=data)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return res, updates
+
+    def test_edit_venue_updates_only_changed_columns(self):
+        self.edit_venue(1)
+        res, updates = self.edit_venue(2)
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(updates, [])
+
+        res, updates = self.edit_venue(2, phone='415-000-1234')
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(len(updates), 1)
+        columns = updates[0].split(' SET ')[1].split(' WHERE ')[0]
+        self.assertEqual(columns, 'phone=%(phone)s, version=%(version)s')
+        with self.app.app_context():
+            venue = Venue.query.get(self.venue_id)
+            self.assertEqual((venue.phone, venue.version), ('415-000-1234', 3))
+
+    def test_edit_venue_rejects_stale_version(self):
+        self.edit_venue(1, phone='415-000-1234')
+        res, updates = self.edit_venue(1, phone='415-999-9999')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('changed by someone else', res.data.decode())
+        self.assertIn('415-000-1234', res.data.decode())
+        self.assertEqual(updates, [])
+        with self.app.app_context():
+            self.assertEqual(Venue.query.get(self.venue_id).phone, '415-000-1234')
+
+    # Test JSON API
+
+    def test_get_api_venue(self):
+        self.add_shows(2)
+        res = self.client().get('/api/venues/{}'.format(self.venue_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['name'], 'The Musical Hop')
+        self.assertEqual(data['upcoming_shows_count'], 1)
+        self.assertEqual(data['upcoming_shows'][0]['artist_name'], 'Guns N Petals')
+        datetime.fromisoformat(data['upcoming_shows'][0]['start_time'])
+
+    def test_404_api_artist_not_found(self):
+        res = self.client().get('/api/artists/100000')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(json.loads(res.data)['success'])
+
+    def test_api_answers_matching_etag_with_304(self):
+        url = '/api/venues/{}'.format(self.venue_id)
+        res = self.client().get(url)
+        etag = res.headers['ETag']
+        self.assertEqual(res.status_code, 200)
+
+        res, queries = self.count_queries(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(queries, 1)
+
+        self.add_shows(1)
+        res = self.client().get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_cached_api_response_follows_the_data_version(self):
+        response_cache.backend = MemoryCache()
+        try:
+            res = self.client().get('/api/venues')
+            etag = res.headers['ETag']
+            self.assertEqual(self.client().get('/api/venues').headers['X-Cache'], 'HIT')
+
+            # written by another process, so this one's cache version is not bumped
+            with self.app.app_context():
+                db.session.add(Venue(name='The Dueling Pianos Bar', city='New York', state='NY',
+                                     address='335 Delancey Street', phone='', genres=['Jazz']))
+                db.session.commit()
+            res = self.client().get('/api/venues')
+            self.assertEqual(res.headers['X-Cache'], 'MISS')
+            self.assertNotEqual(res.headers['ETag'], etag)
+            self.assertIn('The Dueling Pianos Bar', res.data.decode())
+        finally:
+            response_cache.backend = NullCache()
+
+    # Test static assets
+
+    def test_build_and_serve_fingerprinted_assets(self):
+        with tempfile.TemporaryDirectory() as static_folder:
+            os.makedirs(os.path.join(static_folder, 'css'))
+            os.makedirs(os.path.join(static_folder, 'fonts'))
+            with open(os.path.join(static_folder, 'fonts', 'icons.ttf'), 'wb') as f:
+                f.write(b'font' * 100)
+            with open(os.path.join(static_folder, 'css', 'main.css'), 'w') as f:
+                f.write('@font-face { src: url("../fonts/icons.ttf?v=1"); }\n' + 'body { color: red; }\n' * 50)
+
+            manifest = build_assets(static_folder, 'dist')
+            font = manifest['fonts/icons.ttf']
+            self.assertRegex(manifest['css/main.css'], r'^css/main\.[0-9a-f]{10}\.css$')
+            with open(os.path.join(static_folder, 'dist', manifest['css/main.css'])) as f:
+                self.assertIn('url("../{}?v=1")'.format(font), f.read())
+
+            static_app = Flask(__name__, static_folder=static_folder, static_url_path='/static')
+            Assets(static_app)
+            with static_app.test_request_context():
+                url = url_for('static', filename='css/main.css')
+            self.assertEqual(url, '/static/dist/' + manifest['css/main.css'])
+
+            res = static_app.test_client().get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(res.headers['Content-Type'], 'text/css; charset=utf-8')
+            self.assertIn('immutable', res.headers['Cache-Control'])
+            self.assertIn(b'color: red', gzip.decompress(res.data))
+            res.close()
+
+            res = static_app.test_client().get(url)
+            self.assertNotIn('Content-Encoding', res.headers)
+            res.close()
+
+    # Test response cache
+
+    def test_cached_page_is_refreshed_after_write(self):
+        response_cache.backend = MemoryCache()
+        try:
+            res, queries = self.count_queries('/venues')
+            self.assertEqual(res.headers['X-Cache'], 'MISS')
+            self.assertTrue(queries)
+
+            res, queries = self.count_queries('/venues')
+            self.assertEqual(res.headers['X-Cache'], 'HIT')
+            self.assertEqual(queries, 0)
+
+            self.client().post('/venues/create', data={
+                'name': 'The Dueling Pianos Bar',
+                'city': 'New York',
+                'state': 'NY',
+                'address': '335 Delancey Street',
+                'phone': '914-003-1132',
+                'genres': ['Classical'],
+                'image_link': '',
+                'website': '',
+                'facebook_link': '',
+                'seeking_description': '',
+            })
+            res = self.client().get('/venues')
+            self.assertEqual(res.headers['X-Cache'], 'MISS')
+            self.assertIn('The Dueling Pianos Bar', res.data.decode())
+        finally:
+            response_cache.backend = NullCache()
+
+    def test_commands_run_without_statement_timeout(self):
+        def statement_timeout():
+            return db.session.execute('SHOW statement_timeout').scalar()
+
+        with self.app.app_context():
+            self.assertEqual(without_statement_timeout(statement_timeout)(), '0')
+            db.session.remove()
+            self.assertEqual(statement_timeout(), '30s')
+
+    def test_commands_warn_when_workers_keep_their_cache(self):
+        runner = self.app.test_cli_runner()
+        response_cache.backend = MemoryCache()
+        try:
+            result = runner.invoke(args=['recount-shows'])
+            self.assertIn('Show counters recomputed.', result.output)
+            self.assertIn('RESPONSE_CACHE=filesystem', result.output)
+
+            with tempfile.TemporaryDirectory() as directory:
+                response_cache.backend = FileSystemCache(directory)
+                result = runner.invoke(args=['recount-shows'])
+                self.assertNotIn('RESPONSE_CACHE', result.output)
+                self.assertEqual(response_cache.backend.get_version(), 1)
+        finally:
+            response_cache.backend = NullCache()
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
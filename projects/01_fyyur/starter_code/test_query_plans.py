@@ -0,0 +1,206 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+# point the app at the test database before config.py is loaded
+os.environ['DB_NAME'] = os.getenv('TEST_DB_NAME', 'fyyur_test')
+os.environ['RESPONSE_CACHE'] = 'null'
+os.environ['JOBS_WORKERS'] = '0'
+os.environ['JOBS_DB'] = os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3')
+
+from sqlalchemy import event
+
+from app import app, encode_cursor
+from importer import write_rows
+from models import db, Venue, Artist, Show
+
+NUM_VENUES = int(os.getenv('PLAN_TEST_VENUES', 20000))
+NUM_ARTISTS = int(os.getenv('PLAN_TEST_ARTISTS', 5000))
+NUM_SHOWS = int(os.getenv('PLAN_TEST_SHOWS', 200000))
+
+# genres most rows share, and one that only a few rows have, so the
+# filtered listings are selective enough to need an index
+COMMON_GENRES = ['Jazz', 'Rock n Roll', 'Pop', 'Folk']
+RARE_GENRE = 'Musical Theatre'
+
+# pages that list every row of a table may read all of it; /venues is not
+# here because ix_Venue_state_city_id returns its rows already in order
+FULL_READS = {
+    '/artists': {'Artist'},
+}
+LARGE_TABLES = {'Venue', 'Artist', 'Show'}
+
+
+def seq_scans(plan):
+    '''Yield the relations a plan reads with a sequential scan.'''
+    if plan['Node Type'] == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Runs EXPLAIN on every query of the hot pages against a large dataset"""
+
+    @classmethod
+    def setUpClass(cls):
+        random.seed(0)
+        app.config['WTF_CSRF_ENABLED'] = False
+        now = datetime.now()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as connection:
+                # filling the exclusion constraints' GiST indexes takes a while
+                connection.execute('SET LOCAL statement_timeout = 0')
+                write_rows(connection, Venue.__table__, [{
+                    'name': 'Venue {}'.format(i),
+                    'city': 'City {}'.format(i % 2000),
+                    'state': 'S{}'.format(i % 50),
+                    'genres': [RARE_GENRE if i % 500 == 0 else random.choice(COMMON_GENRES)],
+                } for i in range(NUM_VENUES)])
+                write_rows(connection, Artist.__table__, [{
+                    'name': 'Artist {}'.format(i),
+                    'genres': [RARE_GENRE if i % 500 == 0 else random.choice(COMMON_GENRES)],
+                } for i in range(NUM_ARTISTS)])
+                # one show every other minute, so no two bookings overlap
+                slots = random.sample(range(-NUM_SHOWS, NUM_SHOWS), NUM_SHOWS)
+                write_rows(connection, Show.__table__, [{
+                    'venue_id': random.randint(1, NUM_VENUES),
+                    'artist_id': random.randint(1, NUM_ARTISTS),
+                    'start_time': now + timedelta(minutes=2 * slot),
+                    'duration': 1,
+                } for slot in slots])
+            with db.engine.connect() as connection:
+                connection.execution_options(isolation_level='AUTOCOMMIT').execute('ANALYZE')
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def setUp(self):
+        self.client = app.test_client
+
+    def capture_queries(self, method, url, **kwargs):
+        """Return the statements a request runs, with their parameters"""
+        queries = []
+        with app.app_context():
+            engine = db.engine
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            streamed = context.execution_options.get('stream_results', False)
+            queries.append((statement, parameters, streamed))
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().open(url, method=method, **kwargs)
+            res.get_data()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(res.status_code, 200)
+        return engine, queries
+
+    def explain(self, engine, statement, parameters, streamed):
+        # streamed queries run through a server-side cursor, which the
+        # planner optimises for returning the first rows quickly
+        if streamed:
+            statement = 'DECLARE plan_check CURSOR FOR ' + statement
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+            plan = cursor.fetchone()[0]
+            connection.rollback()
+        finally:
+            connection.close()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def assertNoSeqScans(self, method, url, **kwargs):
+        engine, queries = self.capture_queries(method, url, **kwargs)
+        self.assertTrue(queries)
+        allowed = FULL_READS.get(url, set())
+        for statement, parameters, streamed in queries:
+            plan = self.explain(engine, statement, parameters, streamed)
+            scanned = (set(seq_scans(plan)) & LARGE_TABLES) - allowed
+            self.assertFalse(scanned, 'Sequential scan of {} for {} {}:\n{}\n{}'.format(
+                ', '.join(sorted(scanned)), method, url, statement, json.dumps(plan, indent=2)))
+
+    # Test listings
+
+    def test_venues_plan(self):
+        self.assertNoSeqScans('GET', '/venues')
+
+    def test_venues_by_genre_plan(self):
+        self.assertNoSeqScans('GET', '/venues?genre={}'.format(RARE_GENRE))
+
+    def test_artists_plan(self):
+        self.assertNoSeqScans('GET', '/artists')
+
+    def test_artists_by_genre_plan(self):
+        self.assertNoSeqScans('GET', '/artists?genre={}'.format(RARE_GENRE))
+
+    def test_shows_plan(self):
+        self.assertNoSeqScans('GET', '/shows')
+
+    def test_shows_next_page_plan(self):
+        cursor = encode_cursor(Show(id=NUM_SHOWS // 2, start_time=datetime.now()))
+        self.assertNoSeqScans('GET', '/shows?after={}'.format(cursor))
+        self.assertNoSeqScans('GET', '/shows?before={}'.format(cursor))
+
+    # Test detail pages
+
+    def test_show_venue_plan(self):
+        self.assertNoSeqScans('GET', '/venues/{}'.format(NUM_VENUES // 2))
+
+    def test_show_artist_plan(self):
+        self.assertNoSeqScans('GET', '/artists/{}'.format(NUM_ARTISTS // 2))
+
+    # Test calendars
+
+    def test_calendar_plans(self):
+        self.assertNoSeqScans('GET', '/venues/{}/calendar.ics'.format(NUM_VENUES // 2))
+        self.assertNoSeqScans('GET', '/artists/{}/calendar.ics'.format(NUM_ARTISTS // 2))
+
+    # Test matchmaking
+
+    def test_matches_plans(self):
+        # the first venue and artist have the rare genre, so the candidates
+        # are a small part of the tables
+        self.assertNoSeqScans('GET', '/artists/1/matches')
+        self.assertNoSeqScans('GET', '/venues/1/matches')
+
+    # Test writes
+
+    def test_create_show_plan(self):
+        # the double-booking probes must stay index lookups
+        self.assertNoSeqScans('POST', '/shows/create', data={
+            'venue_id': NUM_VENUES // 2, 'artist_id': NUM_ARTISTS // 2,
+            'start_time': '2040-01-01 20:00:00', 'duration': '120'})
+
+    def test_delete_venue_plan(self):
+        # the shows and counters of the venue are found through indexes;
+        # a venue the other tests do not read
+        self.assertNoSeqScans('DELETE', '/venues/{}'.format(NUM_VENUES // 3))
+
+    # Test search
+
+    def test_search_plans(self):
+        with app.app_context():
+            installed = db.session.execute(
+                "SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'").scalar()
+        if not installed:
+            self.skipTest('pg_trgm is not installed')
+        self.assertNoSeqScans('POST', '/venues/search', data={'search_term': 'Venue 123'})
+        self.assertNoSeqScans('POST', '/artists/search', data={'search_term': 'Artist 123'})
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()